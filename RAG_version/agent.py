@@ -1,57 +1,67 @@
 import os
 from dotenv import load_dotenv
-from langchain_core.prompts import PromptTemplate
-from huggingface_hub import InferenceClient
-import faiss
-import pickle
-import numpy as np
+import sys
 import tools
+from doc_store import load_docs
+from vector_store import NumpyIndex
+
+# 让 RAG_version 里的脚本也能 import 仓库根目录下的 Utils
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Utils.prompt_layout import PROMPT_TEMPLATES, build_messages, build_system_prompt
+from Utils.llm_backends import get_backend
+from Utils.budget import budgeted_invoke
 
 
 class MyRetriever:
-    def __init__(self, index_path="medical_docs.index", docs_path="medical_docs.pkl", model_name="BAAI/bge-small-en", token=None):
+    def __init__(self, index_path="medical_docs.index", docs_path="medical_docs", model_name="BAAI/bge-small-en", token=None,
+                 backend="faiss", vectors_path="medical_docs", reranker=None, fetch_k=20):
+        # faiss / huggingface_hub 只有真正用到检索时才 import
+        from huggingface_hub import InferenceClient
+
         self.client = InferenceClient(token=token)
-        self.index = faiss.read_index(index_path)
-        with open(docs_path, "rb") as f:
-            self.docs = pickle.load(f)
+        if backend == "numpy":
+            # 压缩向量（float16 / int8）+ NumPy 精确余弦检索，不依赖 faiss（见 vector_store.py）
+            self.index = NumpyIndex.load(vectors_path)
+        else:
+            import faiss
+            self.index = faiss.read_index(index_path)
+        # mmap 的 DocStore：只在检索命中时解码对应的文档（旧的 .pkl 路径仍然可用）
+        self.docs = load_docs(docs_path)
         self.model_name = model_name
+        # 可选的 rerank 阶段（见 reranker.py）：先便宜地取 fetch_k 条候选，再精排出 top_k
+        self.reranker = reranker
+        self.fetch_k = fetch_k
+
+    def search(self, query, top_k=3):
+        """
+        向量检索，返回 [(doc_id, distance), ...]，距离越小越相关。
+        """
+        import numpy as np
 
-    def retrieve(self, query, top_k=3):
         # embed query
         q_emb = self.client.feature_extraction(query, model=self.model_name)
-        q_emb = np.array(q_emb)
+        q_emb = np.array(q_emb, dtype="float32")
         # 如果是一维向量 reshape 为 (1, dim)
         if len(q_emb.shape) == 1:
             q_emb = q_emb.reshape(1, -1)
 
         # 检索 top_k
         D, I = self.index.search(q_emb, top_k)
-        results = [self.docs[i] for i in I[0]]
+        return [(int(i), float(d)) for i, d in zip(I[0], D[0]) if i != -1]
+
+    def retrieve(self, query, top_k=3):
+        if self.reranker is not None:
+            candidates = self.search(query, max(self.fetch_k, top_k))
+            hits = self.reranker.rerank(query, candidates, self.docs, top_k)
+        else:
+            hits = self.search(query, top_k)
+        results = [self.docs[i] for i, _ in hits]
         return "\n".join(results)  # 拼成文本
     
 
 
-# ========== HF Model Wrapper (LangChain-Compatible) ==========
-class HFChatModel:
-    """
-    A simple wrapper to replicate ChatOpenAI-style interface using HuggingFace InferenceClient.
-    """
-    def __init__(self, model_name="openai/gpt-oss-120b", temperature=0):
-        self.client = InferenceClient(model_name) # InferenceClient 默认会去查找环境变量：默认读取 os.environ["HF_TOKEN"]
-        self.temperature = temperature
-
-    def invoke(self, prompt):
-        response = self.client.chat_completion(
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=800,
-            temperature=self.temperature,
-        )
-        # HuggingFace returns: response.choices[0].message
-        return response.choices[0].message["content"]
-    
-
 class Agent:
-    def __init__(self, medical_report=None, role=None, extra_info=None, retriever=None, extra_rag_context=None):
+    def __init__(self, medical_report=None, role=None, extra_info=None, retriever=None, extra_rag_context=None, router=None, budget=None):
     # 在main.py中retrieve一次得到的extra_rag_context直接导入，就可以做到只检索一次，效率更高。所有 Specialist Agents 共享同一份 RAG 内容。
     # 如果要针对不同agent分别检索，就可以再调用 retriever
         self.medical_report = medical_report
@@ -59,84 +69,44 @@ class Agent:
         self.extra_info = extra_info
         self.retriever = retriever 
         self.extra_rag_context = extra_rag_context  # 这里存一次检索结果
+        self.router = router  # 可选的 CascadeRouter：先小模型，必要时升级到大模型
+        self.budget = budget  # 可选的 RunBudget（Utils/budget.py），同一份报告的所有 agent 共享
+        self.system_prompt = build_system_prompt(role)
         self.prompt_template = self.create_prompt_template()
 
-        self.model = HFChatModel(
-            model_name="openai/gpt-oss-120b",
-            temperature=0
-        )
+        # 每个角色可以单独配置后端（见 Utils/llm_backends.py），默认仍是 HF 上的 gpt-oss-120b
+        self.model = get_backend(role)
+        # 最近一次调用的模型、延迟和 token 数，供 Utils/results_store.py 记录
+        self.last_call = None
+        self.tool_output = ""
 
     
     def create_prompt_template(self):
-        # --- Integrator Agent (MDT) ---
-        if self.role == "MultidisciplinaryTeam":
-            template = f"""
-                Act like a multidisciplinary team consisting of a Cardiologist and a Psychologist.
-
-                Task:
-                - Integrate both specialist reports.
-                - Provide exactly **3 possible diagnoses**.
-                - For each diagnosis, explain briefly:
-                    1. Why this diagnosis is plausible
-                    2. Whether the cause is cardiac, psychological, or mixed.
-
-                Output:
-                - Bullet list with 3 items.
-                - translate the final output to Chinese.
-
-                Cardiologist Report:
-                {self.extra_info.get('cardiologist_report', '')}
-
-                Psychologist Report:
-                {self.extra_info.get('psychologist_report', '')}
-            """
-            return PromptTemplate.from_template(template)
-
-        # --- Specialist Agents ---
-        templates = {
-            "Cardiologist": """
-                Act like a cardiologist.
-
-                Task:
-                - Analyze the patient's ECG, labs, symptoms, and cardiac history.
-                - Identify possible cardiac causes: arrhythmias, coronary issues, structural problems.
-                - Recommend next steps (tests, monitoring).
-
-                Output:
-                - Cardiac causes + recommended next steps.
+        # 静态的角色说明在 system message 里，每份报告不同的部分用 Utils/prompt_layout.py 里预编译好的模板
+        return PROMPT_TEMPLATES[self.role]
 
-                Medical Report:
-                {medical_report}
-            """,
-
-            "Psychologist": """
-                Act like a psychologist.
-
-                Task:
-                - Analyze emotional and behavioral symptoms.
-                - Identify possible mental health issues: anxiety, depression, trauma, stress-related disorders.
-                - Recommend next steps.
-
-                Output:
-                - Possible psychological issues + next steps.
-
-                Patient Report:
-                {medical_report}
-            """
-        }
-        return PromptTemplate.from_template(templates[self.role])
+    def trim(self, text):
+        # 预算紧张时每段上下文都会被截断
+        return self.budget.trim(text) if self.budget is not None else text
 
+    def format_user_content(self):
+        if self.role == "MultidisciplinaryTeam":
+            return self.prompt_template.format(**{key: self.trim(value) for key, value in self.extra_info.items()})
+        return self.prompt_template.format(medical_report=self.trim(self.medical_report))
 
-    # -------------------------
-    # Run the Agent
-    # -------------------------
-    def run(self):
-        print(f"{self.role} is running...")
 
+    def input_messages(self, system_prompt=None, verbose=False):
+        """
+        返回发送给模型的消息，工具输出留在 self.tool_output 里给级联路由用。
+        ResultsStore.lookup_agent 用同样的消息判断输入是否完全相同，所以工具输出和 RAG 内容都算在里面。
+        """
         rag_context = self.extra_rag_context if self.role in ["Cardiologist", "Psychologist"] else ""
+        # 预算快用完时不再带 RAG 内容
+        if self.budget is not None and self.budget.skip_rag:
+            rag_context = ""
 
         # 打印检索内容
-        if rag_context:
+        if rag_context and verbose:
             print(f"\n=== RAG Retrieved Docs for {self.role} ===")
             print(rag_context)
             print("="*50)
@@ -153,25 +123,45 @@ class Agent:
                 tool_output = tools.assess_psych_risk(self.medical_report)
         except Exception as e:
             print(f"Tool call failed for {self.role}: {e}")
+        self.tool_output = tool_output
 
-        if tool_output:
+        if tool_output and verbose:
             print(f"\n=== Tool Output for {self.role} ===")
             print(tool_output)
             print("="*50)
 
 
-        # 格式化 prompt
+        # 格式化 prompt：固定的角色说明在 system message，
+        # 工具输出、RAG 内容和报告都随报告变化，统一放在最后的 user message 里
+        system_prompt = system_prompt or self.system_prompt
         if self.role == "MultidisciplinaryTeam":
-            prompt = self.prompt_template.format()
+            messages = build_messages(system_prompt, [(None, self.format_user_content())])
         else:
-            prompt = self.prompt_template.format(medical_report=self.medical_report)
-            if rag_context:
-                prompt = f"### Reference from external medical library:\n{rag_context}\n\n{prompt}"
-            if tool_output:
-                prompt = f"### Tool-assisted analysis:\n{tool_output}\n\n{prompt}"
+            messages = build_messages(system_prompt, [
+                ("### Tool-assisted analysis", self.trim(tool_output)),
+                ("### Reference from external medical library", self.trim(rag_context)),
+                (None, self.format_user_content()),
+            ])
+        return messages
+
+
+    # -------------------------
+    # Run the Agent
+    # -------------------------
+    def run(self):
+        print(f"{self.role} is running...")
+
+        messages = self.input_messages(verbose=True)
 
         try:
-            response = self.model.invoke(prompt)
+            # 预算用掉一半后改用小模型（此时也不再走 cascade 路由）
+            model = self.budget.model_for(self.model) if self.budget is not None else self.model
+            if self.router is not None and self.role in ["Cardiologist", "Psychologist"] and model is self.model:
+                flags = tools.red_flags(self.tool_output)
+                # 级联可能调用两次模型，由 router 按每次调用分别计入预算
+                response, self.last_call = self.router.run(self.role, messages, rule_flags=flags, budget=self.budget)
+            else:
+                response, self.last_call = budgeted_invoke(self.budget, self.role, model, messages)
             return response
         except Exception as e:
             print("Error occurred:", e)
@@ -182,20 +172,21 @@ class Agent:
 # ========== Specialized Agents ==========
 
 class Cardiologist(Agent):
-    def __init__(self, medical_report, retriever=None, extra_rag_context=None):
-        super().__init__(medical_report=medical_report, role="Cardiologist", retriever=retriever)
+    def __init__(self, medical_report, retriever=None, extra_rag_context=None, router=None, budget=None):
+        super().__init__(medical_report=medical_report, role="Cardiologist", retriever=retriever, extra_rag_context=extra_rag_context, router=router, budget=budget)
 
 class Psychologist(Agent):
-    def __init__(self, medical_report, retriever=None, extra_rag_context=None):
-        super().__init__(medical_report=medical_report, role="Psychologist", retriever=retriever)
+    def __init__(self, medical_report, retriever=None, extra_rag_context=None, router=None, budget=None):
+        super().__init__(medical_report=medical_report, role="Psychologist", retriever=retriever, extra_rag_context=extra_rag_context, router=router, budget=budget)
 
 
 class MultidisciplinaryTeam(Agent):
-    def __init__(self, cardiologist_report, psychologist_report):
+    def __init__(self, cardiologist_report, psychologist_report, budget=None):
         super().__init__(
             role="MultidisciplinaryTeam",
             extra_info={
                 "cardiologist_report": cardiologist_report,
                 "psychologist_report": psychologist_report
-            }
+            },
+            budget=budget
         )
\ No newline at end of file
@@ -0,0 +1,81 @@
+import mmap
+import os
+
+# numpy 在用到时才 import，RAG_version/agent.py import 本模块时不拖慢启动
+
+
+# ========== Memory-Mapped Document Store ==========
+class DocStore:
+    """
+    文档库的磁盘格式（替代 pickle 的整列表）：
+
+        <prefix>.bin           所有文档 UTF-8 编码后首尾相接的一整块文本
+        <prefix>.offsets.npy   int64 数组，长度 n+1，第 i 篇文档是 bin[offsets[i]:offsets[i+1]]
+        <prefix>.meta.<name>.npy  可选的元数据列（数值或定长字符串），与文档一一对应
+
+    打开时只做 mmap，不读内容，加载时间与文档数无关；检索只解码 FAISS 返回的那 top_k 篇。
+    只读 mmap 走操作系统的 page cache，多个 worker 进程共享同一份物理内存。
+    """
+
+    def __init__(self, prefix):
+        import numpy as np
+
+        self.prefix = prefix
+        self.offsets = np.load(f"{prefix}.offsets.npy", mmap_mode="r")
+        self._file = open(f"{prefix}.bin", "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        # 空文件不能 mmap
+        self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._columns = {}
+
+    @staticmethod
+    def write(docs, prefix, metadata=None):
+        import numpy as np
+
+        offsets = np.zeros(len(docs) + 1, dtype=np.int64)
+        with open(f"{prefix}.bin", "wb") as f:
+            for i, doc in enumerate(docs):
+                data = doc.encode("utf-8")
+                f.write(data)
+                offsets[i + 1] = offsets[i] + len(data)
+        np.save(f"{prefix}.offsets.npy", offsets)
+        for name, values in (metadata or {}).items():
+            column = np.asarray(values)
+            if column.dtype == object or len(column) != len(docs):
+                raise ValueError(f"Metadata column '{name}' must be a numeric or fixed-width array with one value per document")
+            np.save(f"{prefix}.meta.{name}.npy", column)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._blob[int(self.offsets[i]):int(self.offsets[i + 1])].decode("utf-8")
+
+    def get_many(self, ids):
+        return [self[i] for i in ids]
+
+    def column(self, name):
+        import numpy as np
+
+        if name not in self._columns:
+            self._columns[name] = np.load(f"{self.prefix}.meta.{name}.npy", mmap_mode="r")
+        return self._columns[name]
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        self._file.close()
+
+
+def load_docs(docs_path):
+    """
+    兼容旧格式：.pkl 仍按 pickle 读入整个列表，其余路径当作 DocStore 的前缀。
+    """
+    if docs_path.endswith(".pkl"):
+        import pickle
+
+        with open(docs_path, "rb") as f:
+            return pickle.load(f)
+    return DocStore(docs_path)
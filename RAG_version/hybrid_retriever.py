@@ -0,0 +1,37 @@
+from collections import defaultdict
+
+from agent import MyRetriever
+from lexical_index import BM25Index, expand_query
+
+
+# ========== Hybrid Retriever ==========
+class HybridRetriever(MyRetriever):
+    """
+    BM25（带中文分词和医学同义词扩展）+ FAISS 向量检索，用 Reciprocal Rank Fusion 融合两路排名。
+    model_name 可以换成多语言向量模型（例如 BAAI/bge-m3），前提是索引用同一个模型构建（见 vdb.py）。
+    """
+
+    def __init__(self, index_path="medical_docs.index", docs_path="medical_docs", bm25_path="medical_docs.bm25.json",
+                 model_name="BAAI/bge-small-en", token=None, lexical_weight=1.0, dense_weight=1.0, rrf_k=60, **kwargs):
+        super().__init__(index_path=index_path, docs_path=docs_path, model_name=model_name, token=token, **kwargs)
+        self.bm25 = BM25Index.load(bm25_path)
+        self.lexical_weight = lexical_weight
+        self.dense_weight = dense_weight
+        self.rrf_k = rrf_k
+
+    def search(self, query, top_k=3, fetch_k=10):
+        """
+        返回融合后的 [(doc_id, score), ...]，分数越大越相关。
+        两路各取 max(fetch_k, top_k) 条：开了 rerank 时 retrieve() 会把自己的 fetch_k 当作 top_k 传进来，
+        候选数不能被这里的默认值截断。
+        """
+        fetch_k = max(fetch_k, top_k)
+        lexical = self.bm25.search(expand_query(query), fetch_k)
+        dense = super().search(query, min(fetch_k, self.index.ntotal))
+
+        fused = defaultdict(float)
+        for rank, (doc_id, _) in enumerate(lexical):
+            fused[doc_id] += self.lexical_weight / (self.rrf_k + rank + 1)
+        for rank, (doc_id, _) in enumerate(dense):
+            fused[doc_id] += self.dense_weight / (self.rrf_k + rank + 1)
+        return sorted(fused.items(), key=lambda item: -item[1])[:top_k]
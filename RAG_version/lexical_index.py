@@ -0,0 +1,135 @@
+import json
+import math
+import re
+from collections import Counter, defaultdict
+
+# ========== Medical Synonyms (cross-lingual) ==========
+# 中文报告 + 英文文档库：查询时把中文医学术语扩展成英文同义词（反之亦然），
+# 这样即使向量模型是英文的，词法检索也能跨语言命中。
+MEDICAL_SYNONYMS = {
+    "胸痛": ["chest pain"],
+    "胸闷": ["chest pain", "chest tightness"],
+    "心悸": ["palpitations"],
+    "心绞痛": ["angina"],
+    "心肌梗死": ["myocardial infarction"],
+    "心梗": ["myocardial infarction"],
+    "高血压": ["hypertension", "high blood pressure"],
+    "血压": ["blood pressure"],
+    "头晕": ["dizziness"],
+    "气短": ["shortness of breath"],
+    "呼吸困难": ["shortness of breath"],
+    "咳嗽": ["cough"],
+    "喘息": ["wheezing"],
+    "哮喘": ["asthma"],
+    "慢阻肺": ["copd"],
+    "乏力": ["fatigue"],
+    "疲劳": ["fatigue"],
+    "焦虑": ["anxiety"],
+    "惊恐": ["panic"],
+    "惊恐发作": ["panic attacks"],
+    "抑郁": ["depression"],
+    "情绪低落": ["depression"],
+    "失眠": ["insomnia"],
+    "心理咨询": ["psychological counseling"],
+    "认知行为治疗": ["cognitive therapy"],
+    "药物副作用": ["medication side effects"],
+    "肺功能": ["pulmonary function test"],
+}
+
+# 反向映射：英文术语 -> 中文
+for _zh, _ens in list(MEDICAL_SYNONYMS.items()):
+    for _en in _ens:
+        MEDICAL_SYNONYMS.setdefault(_en, []).append(_zh)
+
+_WORD_RE = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+_CJK_RE = re.compile(r"[一-鿿]+")
+_STOPWORDS = {"a", "an", "and", "or", "the", "of", "to", "in", "with", "for", "has", "is", "are", "patient", "患者"}
+
+try:
+    import jieba
+    for _term in MEDICAL_SYNONYMS:
+        if _CJK_RE.fullmatch(_term):
+            jieba.add_word(_term)
+except ImportError:
+    jieba = None
+
+
+def tokenize(text):
+    """
+    英文按单词切分；中文优先用 jieba 分词，没装 jieba 时退化为单字 + 双字（bigram）。
+    """
+    text = text.lower()
+    tokens = _WORD_RE.findall(text)
+    for chunk in _CJK_RE.findall(text):
+        if jieba is not None:
+            tokens.extend(w for w in jieba.lcut_for_search(chunk) if w.strip())
+        else:
+            tokens.extend(chunk)
+            tokens.extend(chunk[i:i + 2] for i in range(len(chunk) - 1))
+    return [t for t in tokens if t not in _STOPWORDS]
+
+
+def expand_query(text):
+    """
+    在分词结果上追加医学同义词的分词（包括跨语言的）。
+    """
+    tokens = tokenize(text)
+    lowered = text.lower()
+    for term, synonyms in MEDICAL_SYNONYMS.items():
+        if term in lowered:
+            for synonym in synonyms:
+                tokens.extend(tokenize(synonym))
+    return tokens
+
+
+# ========== BM25 Inverted Index ==========
+class BM25Index:
+    """
+    纯 Python 的 BM25 倒排索引，进程内查询，只遍历查询词对应的 posting list。
+    索引保存为 JSON（不用 pickle）。
+    """
+
+    def __init__(self, postings, doc_lengths, k1=1.5, b=0.75):
+        self.postings = postings  # term -> [[doc_id, tf], ...]
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.n_docs = len(doc_lengths)
+        self.avg_len = sum(doc_lengths) / self.n_docs if self.n_docs else 0.0
+        self.idf = {
+            term: math.log(1 + (self.n_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+            for term, plist in postings.items()
+        }
+
+    @classmethod
+    def build(cls, docs, **kwargs):
+        postings = defaultdict(list)
+        doc_lengths = []
+        for doc_id, doc in enumerate(docs):
+            counts = Counter(tokenize(doc))
+            doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings[term].append([doc_id, tf])
+        return cls(dict(postings), doc_lengths, **kwargs)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "doc_lengths": self.doc_lengths, "postings": self.postings}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            data = json.load(f)
+        return cls(data["postings"], data["doc_lengths"], k1=data["k1"], b=data["b"])
+
+    def search(self, query_tokens, top_k=10):
+        scores = defaultdict(float)
+        for term, qtf in Counter(query_tokens).items():
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = self.idf[term]
+            for doc_id, tf in plist:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / self.avg_len)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: -item[1])[:top_k]
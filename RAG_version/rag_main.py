@@ -1,10 +1,15 @@
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 from dotenv import load_dotenv
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from agent import Cardiologist, Psychologist, MultidisciplinaryTeam, MyRetriever
+from agent import Cardiologist, Psychologist, MultidisciplinaryTeam
+from hybrid_retriever import HybridRetriever
+from Utils.results_store import ResultsStore
+from Utils.ingestion import read_report
+from Utils.budget import RunBudget
+from Utils.language import Translator, detect_language, output_language
+from Utils.prompt_layout import working_language
 from dotenv import load_dotenv
 import json, os
-from huggingface_hub import InferenceClient
 
 
 # 加载 hf.env 文件
@@ -21,18 +26,27 @@ hf_token = os.environ.get("HF_TOKEN")
 
 
 # read the medical report
-# with open("Medical Reports/medical_report_english.txt", "r") as file:
-with open("medical_report_chinese.txt", "r") as file: # 打开文件后，会把文件对象赋值给 file 变量。
-    medical_report = file.read() # 一次性读取整个文件的内容，返回一个 字符串
+# medical_report = read_report("Medical Reports/medical_report_english.txt")
+# read_report 统一编码和空白（与 batch_main 相同），同一份报告在 results store 里的 report_hash 一致
+medical_report = read_report("medical_report_chinese.txt")
 
 
 # =====================
 # Initialize RAG retriever
 # =====================
-retriever = MyRetriever(
+# BM25（中文分词 + 医学同义词跨语言扩展）与 FAISS 向量检索融合，中文报告也能检索到英文文档
+# 可选：RERANK=1 时先取 20 条候选，再用本地 cross-encoder 精排出 3 条（需要 sentence-transformers）
+reranker = None
+if os.environ.get("RERANK") == "1":
+    from reranker import CrossEncoderReranker
+    reranker = CrossEncoderReranker(cache_path="rerank_cache.sqlite")
+
+retriever = HybridRetriever(
     index_path="medical_docs.index",
-    docs_path="medical_docs.pkl",
-    token=hf_token
+    docs_path="medical_docs",
+    bm25_path="medical_docs.bm25.json",
+    token=hf_token,
+    reranker=reranker
 )
 rag_context = retriever.retrieve(medical_report)
 print("\n=== Retrieved RAG Context ===\n", rag_context)
@@ -40,9 +54,28 @@ print("\n=== Retrieved RAG Context ===\n", rag_context)
 
 
 
+# 语言检测：agent 统一用工作语言推理和输出，报告语言只决定最后把 MDT 结果翻译成什么语言
+report_language = detect_language(medical_report)
+print(f"Report language: {report_language}, working language: {working_language()}")
+
+# 所有输出（含延迟和 token 数）都追加记录到 results/results.sqlite
+# REUSE_RESULTS=1 时，同一份报告、同样模型和 prompt 已经算过的结果直接复用
+store = ResultsStore()
+run_id = store.start_run("rag_main", {"report": "medical_report_chinese.txt", "language": report_language, "rerank": reranker is not None})
+reuse = os.environ.get("REUSE_RESULTS") == "1"
+
+# 这份报告的 token / 调用次数 / LLM 时间预算（BUDGET_MAX_TOKENS 等环境变量），用量高时逐级降级
+budget = RunBudget.from_env()
+
+# 可选：CASCADE=1 时专科先用小模型，规则引擎报警或置信度低时再升级到大模型（见 Utils/cascade.py）
+routers = {}
+if os.environ.get("CASCADE") == "1":
+    from Utils.cascade import CascadeRouter
+    routers = {role: CascadeRouter.for_role(role) for role in ["Cardiologist", "Psychologist"]}
+
 agents = {
-    "Cardiologist": Cardiologist(medical_report, retriever=None, extra_rag_context=rag_context),
-    "Psychologist": Psychologist(medical_report, retriever=None, extra_rag_context=rag_context)
+    "Cardiologist": Cardiologist(medical_report, retriever=None, extra_rag_context=rag_context, router=routers.get("Cardiologist"), budget=budget),
+    "Psychologist": Psychologist(medical_report, retriever=None, extra_rag_context=rag_context, router=routers.get("Psychologist"), budget=budget)
 }
 # agents = {
 #     "Cardiologist": Cardiologist(medical_report, retriever=retriever),
@@ -52,26 +85,36 @@ print("\n")
 print("start llm process")
 # Function to run each agent and get their response
 def get_response(agent_name, agent):
-    response = agent.run()
-    return agent_name, response
+    response, reused = store.run_agent(run_id, agent, medical_report, reuse=reuse)
+    return agent_name, response, reused
 
 # Run the agents concurrently and collect responses
 responses = {}
+reused = {}
 with ThreadPoolExecutor() as executor: # ThreadPoolExecutor()：Python 的线程池 . 作用：让多个 agent 可以并行运行，节省时间
     futures = {executor.submit(get_response, name, agent): name for name, agent in agents.items()}
     for future in as_completed(futures):
-        agent_name, response = future.result() # as_completed(futures) 会按完成顺序迭代线程池中的 Future
+        agent_name, response, reused[agent_name] = future.result() # as_completed(futures) 会按完成顺序迭代线程池中的 Future
         responses[agent_name] = response
 
 team_agent = MultidisciplinaryTeam(
     cardiologist_report=responses["Cardiologist"],
-    psychologist_report=responses["Psychologist"]
+    psychologist_report=responses["Psychologist"],
+    budget=budget
 )
 
 # Run the MultidisciplinaryTeam agent to generate the final diagnosis
-final_diagnosis = team_agent.run()
+# 两份专科报告都是复用的，MDT 的输入也完全相同，可以一起复用
+final_diagnosis, _ = store.run_agent(run_id, team_agent, medical_report, stage="mdt", reuse=reuse and all(reused.values()))
+
+# 只在最后翻译一次最终的 MDT 结果（OUTPUT_LANGUAGE=auto 跟随报告语言，none 不翻译），译文有缓存
+translated, call = Translator().translate(final_diagnosis, output_language(medical_report), budget)
+if translated != final_diagnosis:
+    store.record(run_id, medical_report, "Translator", translated, stage="translation", call=call)
+    final_diagnosis = translated
+store.finish_run(run_id)
 
-final_diagnosis_text = "### Final Diagnosis:\n\n" + final_diagnosis
+final_diagnosis_text = "### Final Diagnosis:\n\n" + (final_diagnosis or "")
 txt_output_path = "results/final_diagnosis.txt"
 
 # Ensure the directory exists
@@ -81,5 +124,8 @@ os.makedirs(os.path.dirname(txt_output_path), exist_ok=True)
 with open(txt_output_path, "w") as txt_file:
     txt_file.write(final_diagnosis_text)
 
-print(f"Final diagnosis has been saved to {txt_output_path}")
+print(f"Final diagnosis has been saved to {txt_output_path} (run {run_id} in {store.path})")
+
+budget.write_report("results/budget_report.json")
+print(budget.summary())
 
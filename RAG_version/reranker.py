@@ -0,0 +1,114 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# 多语言的小型 cross-encoder，CPU 上可以跑；中文报告对英文文档也能打分
+DEFAULT_RERANK_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+
+
+# ========== Cross-Encoder Reranker ==========
+class CrossEncoderReranker:
+    """
+    先用便宜的检索多取 fetch_k 条候选，再用 cross-encoder 成批打分，只保留最好的 top_k 条。
+    prompt 里放更少但更相关的段落，可以减少 prompt token，LLM 调用也更快。
+
+    (query 哈希, 文档内容哈希) -> 分数 会缓存在内存 LRU 里；给了 cache_path 时还会写进 SQLite，跨进程复用。
+    不用 doc_id 做键：doc_id 只是文档在语料里的位置，vdb.py 重建语料后同一个 id 可能对应另一段文本。
+    需要 sentence-transformers（可选依赖，只在第一次打分时 import）。
+    """
+
+    def __init__(self, model_name=DEFAULT_RERANK_MODEL, batch_size=16, max_length=512, cache_path=None, max_cache=100000):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.max_cache = max_cache
+        self.model = None
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        if cache_path:
+            self.db = sqlite3.connect(cache_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS rerank_scores ("
+                "model TEXT, query_hash TEXT, doc_hash TEXT, score REAL, "
+                "PRIMARY KEY (model, query_hash, doc_hash))"
+            )
+
+    def _load_model(self):
+        if self.model is None:
+            from sentence_transformers import CrossEncoder
+            self.model = CrossEncoder(self.model_name, device="cpu", max_length=self.max_length)
+        return self.model
+
+    @staticmethod
+    def query_hash(query):
+        return hashlib.sha1(query.encode("utf-8")).hexdigest()
+
+    # 文档和 query 用同一种哈希
+    doc_hash = query_hash
+
+    def _cached(self, qhash, dhash):
+        key = (qhash, dhash)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        if self.db is not None:
+            row = self.db.execute(
+                "SELECT score FROM rerank_scores WHERE model = ? AND query_hash = ? AND doc_hash = ?",
+                (self.model_name, qhash, dhash),
+            ).fetchone()
+            if row is not None:
+                self._remember(qhash, dhash, row[0])
+                return row[0]
+        return None
+
+    def _remember(self, qhash, dhash, score):
+        self.cache[(qhash, dhash)] = score
+        if len(self.cache) > self.max_cache:
+            self.cache.popitem(last=False)
+
+    def score(self, query, doc_ids, docs):
+        """
+        返回与 doc_ids 一一对应的相关性分数（越大越相关），只对缓存里没有的 (query, doc) 调用模型。
+        """
+        qhash = self.query_hash(query)
+        dhashes = {doc_id: self.doc_hash(docs[doc_id]) for doc_id in doc_ids}
+        scores = {}
+        missing = []
+        with self.lock:
+            for doc_id in doc_ids:
+                cached = self._cached(qhash, dhashes[doc_id])
+                if cached is None:
+                    missing.append(doc_id)
+                else:
+                    scores[doc_id] = cached
+            self.hits += len(doc_ids) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            pairs = [(query, docs[doc_id]) for doc_id in missing]
+            predicted = self._load_model().predict(pairs, batch_size=self.batch_size)
+            with self.lock:
+                for doc_id, score in zip(missing, predicted):
+                    scores[doc_id] = float(score)
+                    self._remember(qhash, dhashes[doc_id], float(score))
+                if self.db is not None:
+                    self.db.executemany(
+                        "INSERT OR REPLACE INTO rerank_scores VALUES (?, ?, ?, ?)",
+                        [(self.model_name, qhash, dhashes[doc_id], scores[doc_id]) for doc_id in missing],
+                    )
+                    self.db.commit()
+        return [scores[doc_id] for doc_id in doc_ids]
+
+    def rerank(self, query, candidates, docs, top_k=3):
+        """
+        candidates 是检索返回的 [(doc_id, 原始分数), ...]；返回重新排序后的前 top_k 条 [(doc_id, rerank 分数), ...]。
+        """
+        doc_ids = [doc_id for doc_id, _ in candidates]
+        if not doc_ids:
+            return []
+        ranked = sorted(zip(doc_ids, self.score(query, doc_ids, docs)), key=lambda item: -item[1])
+        return ranked[:top_k]
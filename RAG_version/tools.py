@@ -10,8 +10,8 @@ def analyze_lab_values(medical_report: str) -> str:
     """
     output = []
 
-    # 检测血压
-    bp_matches = re.findall(r"(血压|BP)[:：\s]*(\d+/\d+)", medical_report)
+    # 检测血压（血压 / BP / blood pressure）
+    bp_matches = re.findall(r"(血压|\bBP\b|\bblood pressure\b)[:：\s]*(\d+/\d+)", medical_report, re.IGNORECASE)
     if bp_matches:
         for match in bp_matches:
             output.append(f"Detected blood pressure: {match[1]}")
@@ -21,8 +21,8 @@ def analyze_lab_values(medical_report: str) -> str:
             elif systolic < 90 or diastolic < 60:
                 output.append("⚠ Low blood pressure detected.")
     
-    # 检测心率
-    hr_matches = re.findall(r"(心率|HR)[:：\s]*(\d+)", medical_report)
+    # 检测心率（中文报告常写作脉搏，英文报告写 heart rate / pulse）
+    hr_matches = re.findall(r"(心率|脉搏|\bHR\b|\bheart rate\b|\bpulse\b)[:：\s]*(\d+)", medical_report, re.IGNORECASE)
     if hr_matches:
         for match in hr_matches:
             hr = int(match[1])
@@ -71,4 +71,28 @@ def assess_psych_risk(medical_report: str) -> str:
     if not output:
         output.append("No clear psychological risk indicators detected.")
 
-    return "\n".join(output)
\ No newline at end of file
+    return "\n".join(output)
+
+# =========================
+# Rule-engine flags
+# =========================
+def red_flags(tool_output: str) -> list:
+    """
+    从工具输出里挑出异常项（"⚠" 开头的指标异常、"Possible ..." 开头的心理风险）。
+    没有异常时返回空列表。
+    """
+    return [
+        line for line in tool_output.splitlines()
+        if line.startswith("⚠") or line.startswith("Possible ")
+    ]
+
+
+def rule_flags(medical_report: str, role: str) -> list:
+    """
+    不调用 LLM，直接用规则判断该角色是否有需要关注的异常。
+    """
+    if role == "Cardiologist":
+        return red_flags(analyze_lab_values(medical_report))
+    if role == "Psychologist":
+        return red_flags(assess_psych_risk(medical_report))
+    return []
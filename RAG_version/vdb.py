@@ -6,7 +6,21 @@ from dotenv import load_dotenv
 from dotenv import load_dotenv
 import os
 import faiss
-import pickle
+import argparse
+from lexical_index import BM25Index
+from doc_store import DocStore
+from vector_store import write_vectors
+
+parser = argparse.ArgumentParser()
+# 中文报告可以换成多语言模型，例如 --model BAAI/bge-m3 --index medical_docs_m3.index
+# （检索时用 MyRetriever(index_path="medical_docs_m3.index", docs_path="medical_docs_m3", vectors_path="medical_docs_m3", model_name="BAAI/bge-m3")）
+parser.add_argument("--model", default="BAAI/bge-small-en")
+parser.add_argument("--index", default="medical_docs.index")
+parser.add_argument("--vector-dtype", default="float16", choices=["float32", "float16", "int8"])
+args = parser.parse_args()
+# 向量、文档库和 BM25 都用 --index 去掉扩展名后的前缀（默认 medical_docs），
+# 换模型建另一套索引时不会覆盖默认模型的 medical_docs.vectors.npy
+prefix = os.path.splitext(args.index)[0]
 
 
 load_dotenv("/Users/zhijietang/Desktop/medical/hf_1.env", override=True)  # 确保文件名正确
@@ -16,8 +30,8 @@ assert hf_token is not None, "HF_TOKEN not loaded!"
 
 client = InferenceClient(token=hf_token)
 
-emb = client.feature_extraction(medical_docs, model="BAAI/bge-small-en")
-emb = np.array(emb) # mean pooling
+emb = client.feature_extraction(medical_docs, model=args.model)
+emb = np.array(emb, dtype="float32") # mean pooling；FAISS 只接受 float32
 
 
 # emb: numpy array, shape (num_docs, embedding_dim)
@@ -28,8 +42,13 @@ index = faiss.IndexFlatL2(embedding_dim)
 index.add(emb)  # 添加所有文档向量
 
 # 保存索引到磁盘
-faiss.write_index(index, "medical_docs.index")
+faiss.write_index(index, args.index)
 
-# 保存原始文档内容（对应向量）
-with open("medical_docs.pkl", "wb") as f:
-    pickle.dump(medical_docs, f)
\ No newline at end of file
+# 保存压缩后的归一化向量，供 MyRetriever(backend="numpy") 使用
+write_vectors(emb, prefix, dtype=args.vector_dtype)
+
+# 保存原始文档内容（对应向量）：mmap 文档库，不再用 pickle
+DocStore.write(medical_docs, prefix)
+
+# 保存 BM25 词法索引（JSON），HybridRetriever 在进程内直接查询
+BM25Index.build(medical_docs).save(f"{prefix}.bm25.json")
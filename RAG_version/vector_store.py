@@ -0,0 +1,88 @@
+# numpy 在用到时才 import，RAG_version/agent.py import 本模块时不拖慢启动
+
+
+def normalize(emb):
+    """
+    转成 float32 并做 L2 归一化，之后内积就是余弦相似度。
+    """
+    import numpy as np
+
+    emb = np.asarray(emb, dtype=np.float32)
+    if emb.ndim == 1:
+        emb = emb.reshape(1, -1)
+    norms = np.linalg.norm(emb, axis=1, keepdims=True)
+    return emb / np.maximum(norms, 1e-12)
+
+
+# ========== Compressed Vector Storage ==========
+def write_vectors(emb, prefix, dtype="float16"):
+    """
+    归一化后按压缩格式保存向量：
+
+        float32 : 不压缩（4 字节/维）
+        float16 : 半精度（2 字节/维）
+        int8    : 按维度对称量化（1 字节/维），另存每一维的 scale 到 <prefix>.scale.npy
+    """
+    import numpy as np
+
+    emb = normalize(emb)
+    if dtype == "int8":
+        scale = np.abs(emb).max(axis=0) / 127.0
+        scale[scale == 0] = 1.0
+        np.save(f"{prefix}.vectors.npy", np.round(emb / scale).astype(np.int8))
+        np.save(f"{prefix}.scale.npy", scale.astype(np.float32))
+    elif dtype in ("float16", "float32"):
+        np.save(f"{prefix}.vectors.npy", emb.astype(dtype))
+    else:
+        raise ValueError(f"Unsupported vector dtype '{dtype}', expected float32 / float16 / int8")
+
+
+class NumpyIndex:
+    """
+    纯 NumPy 的精确余弦检索，接口和 faiss 索引一致：search(q, k) -> (D, I)，ntotal。
+    D 返回 1 - cosine，和 IndexFlatL2 一样越小越相关。
+
+    向量以 mmap 方式加载；按块把整块向量和所有查询做一次矩阵乘法（BLAS），
+    int8 时把 scale 乘到查询向量上，不需要反量化整块数据。
+    小语料的轻量部署可以不装 faiss。
+    """
+
+    def __init__(self, vectors, scale=None, block_size=65536):
+        self.vectors = vectors
+        self.scale = scale
+        self.block_size = block_size
+        self.ntotal = vectors.shape[0]
+        self.d = vectors.shape[1]
+
+    @classmethod
+    def load(cls, prefix, **kwargs):
+        import numpy as np
+
+        vectors = np.load(f"{prefix}.vectors.npy", mmap_mode="r")
+        scale = np.load(f"{prefix}.scale.npy") if vectors.dtype == np.int8 else None
+        return cls(vectors, scale, **kwargs)
+
+    def search(self, q, k):
+        import numpy as np
+
+        q = normalize(q)
+        if self.scale is not None:
+            q = q * self.scale
+        k = min(k, self.ntotal)
+        best_scores = np.full((q.shape[0], 0), -np.inf, dtype=np.float32)
+        best_ids = np.zeros((q.shape[0], 0), dtype=np.int64)
+        for start in range(0, self.ntotal, self.block_size):
+            block = np.asarray(self.vectors[start:start + self.block_size], dtype=np.float32)
+            scores = q @ block.T
+            # 当前块的 top-k 与之前的结果合并
+            top = np.argpartition(-scores, min(k, scores.shape[1]) - 1, axis=1)[:, :k]
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            best_ids = np.concatenate([best_ids, top + start], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_ids = np.take_along_axis(best_ids, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        scores = np.take_along_axis(best_scores, order, axis=1)
+        ids = np.take_along_axis(best_ids, order, axis=1)
+        return 1.0 - scores, ids
@@ -1,102 +1,54 @@
 import os
+import difflib
+from functools import lru_cache
 from dotenv import load_dotenv
-from langchain_core.prompts import PromptTemplate
-from huggingface_hub import InferenceClient
+from Utils.prompt_layout import PROMPT_TEMPLATES, build_messages, build_system_prompt, revision_language_instruction
+from Utils.llm_backends import get_backend
+from Utils.budget import BudgetExceeded, budgeted_invoke
+
+# 全局 LLM：第一次修订时才创建（HF 后端会 import huggingface_hub），import 本模块不再为此变慢
+@lru_cache(maxsize=None)
+def reviser_llm():
+    return get_backend("Reviser")
+
+
+# 增量 MDT 更新用 MDT 角色自己的后端（LLM_BACKEND_MULTIDISCIPLINARYTEAM 等），不落到修订用的模型上
+@lru_cache(maxsize=None)
+def mdt_llm():
+    return get_backend("MultidisciplinaryTeam")
 
-# ========== HF Model Wrapper (LangChain-Compatible) ==========
-class HFChatModel:
-    """
-    A simple wrapper to replicate ChatOpenAI-style interface using HuggingFace InferenceClient.
-    """
-    def __init__(self, model_name="openai/gpt-oss-120b", temperature=0):
-        self.client = InferenceClient(model_name) # InferenceClient 默认会去查找环境变量：默认读取 os.environ["HF_TOKEN"]
-        self.temperature = temperature
-
-    def invoke(self, prompt):
-        response = self.client.chat_completion(
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=800,
-            temperature=self.temperature,
-        )
-        # HuggingFace returns: response.choices[0].message
-        return response.choices[0].message["content"]
-    
-# 全局 LLM
-llm = HFChatModel("openai/gpt-oss-120b", temperature=0)
 
 class Agent:
     def __init__(self, medical_report=None, role=None, extra_info=None):
         self.medical_report = medical_report
         self.role = role
         self.extra_info = extra_info
+        # 专科报告用工作语言写，医生修订时不再重复翻译；只在最后按需翻译 MDT 结果（见 Utils/language.py）
+        self.system_prompt = build_system_prompt(role)
         self.prompt_template = self.create_prompt_template()
 
-        self.model = HFChatModel(
-            model_name="openai/gpt-oss-120b",
-            temperature=0
-        )
+        # 每个角色可以单独配置后端（见 Utils/llm_backends.py），默认仍是 HF 上的 gpt-oss-120b
+        self.model = get_backend(role)
+        # 最近一次调用的模型、延迟和 token 数，供 Utils/results_store.py 记录
+        self.last_call = None
+        # 可选的 RunBudget（Utils/budget.py），同一份报告的所有 agent 和修订共享
+        self.budget = None
 
     
     def create_prompt_template(self):
-        # --- Integrator Agent (MDT) ---
-        if self.role == "MultidisciplinaryTeam":
-            template = f"""
-                Act like a multidisciplinary team consisting of a Cardiologist and a Psychologist.
-
-                Task:
-                - Integrate both specialist reports.
-                - Provide exactly **3 possible diagnoses**.
-                - For each diagnosis, explain briefly:
-                    1. Why this diagnosis is plausible
-                    2. Whether the cause is cardiac, psychological, or mixed.
-
-                Output:
-                - Bullet list with 3 items.
-                - translate the final output to Chinese.
-
-                Cardiologist Report:
-                {self.extra_info.get('cardiologist_report', '')}
-
-                Psychologist Report:
-                {self.extra_info.get('psychologist_report', '')}
-            """
-            return PromptTemplate.from_template(template)
-
-        # --- Specialist Agents ---
-        templates = {
-            "Cardiologist": """
-                Act like a cardiologist.
-
-                Task:
-                - Analyze the patient's ECG, labs, symptoms, and cardiac history.
-                - Identify possible cardiac causes: arrhythmias, coronary issues, structural problems.
-                - Recommend next steps (tests, monitoring).
-
-                Output:
-                - Cardiac causes + recommended next steps.
-                - translate the report to Chinese.
-
-                Medical Report:
-                {medical_report}
-            """,
-
-            "Psychologist": """
-                Act like a psychologist.
-
-                Task:
-                - Analyze emotional and behavioral symptoms.
-                - Identify possible mental health issues: anxiety, depression, trauma, stress-related disorders.
-                - Recommend next steps.
+        # 静态的角色说明在 system message 里，每份报告不同的部分用 Utils/prompt_layout.py 里预编译好的模板
+        return PROMPT_TEMPLATES[self.role]
 
-                Output:
-                - Possible psychological issues + next steps.
-                - translate the report to Chinese.
+    def format_user_content(self):
+        # 预算紧张时每段上下文都会被截断
+        trim = self.budget.trim if self.budget is not None else (lambda text: text)
+        if self.role == "MultidisciplinaryTeam":
+            return self.prompt_template.format(**{key: trim(value) for key, value in self.extra_info.items()})
+        return self.prompt_template.format(medical_report=trim(self.medical_report))
 
-                Patient Report:
-                {medical_report}
-            """
-        }
-        return PromptTemplate.from_template(templates[self.role])
+    def input_messages(self, system_prompt=None):
+        # run() 发送的消息；ResultsStore.lookup_agent 用它判断输入是否完全相同
+        return build_messages(system_prompt or self.system_prompt, [(None, self.format_user_content())])
 
 
     # -------------------------
@@ -105,13 +57,11 @@ class Agent:
     def run(self):
         print(f"{self.role} is running...")
 
-        if self.role == "MultidisciplinaryTeam":
-            prompt = self.prompt_template.format()
-        else:
-            prompt = self.prompt_template.format(medical_report=self.medical_report)
+        messages = self.input_messages()
 
         try:
-            response = self.model.invoke(prompt)
+            model = self.budget.model_for(self.model) if self.budget is not None else self.model
+            response, self.last_call = budgeted_invoke(self.budget, self.role, model, messages)
             return response
         except Exception as e:
             print("Error occurred:", e)
@@ -144,7 +94,11 @@ class MultidisciplinaryTeam(Agent):
 # -------------------------
 # HITL Helper Function
 # -------------------------
-def human_review(initial_text, role_name):
+def human_review(initial_text, role_name, record=None, budget=None):
+    """
+    record(output, call) 可选：医生提出修改、调用了 LLM 时，用修订结果和调用信息回调（见 Utils/results_store.py）。
+    budget 可选：修订调用计入这份报告的 RunBudget；预算已用完时保留原报告。
+    """
     print(f"\n=== {role_name} Initial Report ===\n")
     print(initial_text)
     feedback = input(f"\nPlease enter doctor's feedback for {role_name} report (enter 'None' if no changes): ")
@@ -160,6 +114,72 @@ Initial Report:
 
 Doctor's Feedback:
 {feedback}
+
+{revision_language_instruction()}
+"""
+        model = budget.model_for(reviser_llm()) if budget is not None else reviser_llm()
+        try:
+            final_version, call = budgeted_invoke(budget, "Reviser", model, prompt)
+        except BudgetExceeded as e:
+            print(f"{e}; keeping the {role_name} report unrevised.")
+            return initial_text
+        if record is not None:
+            record(final_version, call)
+    return final_version
+
+
+# -------------------------
+# Incremental MDT update
+# -------------------------
+def report_diff(initial_text, revised_text):
+    """
+    返回初始报告与修订后报告之间的 unified diff（不带上下文行），只包含真正变化的部分。
+    """
+    diff = difflib.unified_diff(
+        (initial_text or "").splitlines(),
+        (revised_text or "").splitlines(),
+        fromfile="initial",
+        tofile="revised",
+        n=0,
+        lineterm="",
+    )
+    return "\n".join(diff)
+
+
+def incremental_mdt_update(previous_mdt, role_name, initial_text, revised_text, model=None, record=None, budget=None):
+    """
+    某一份专科报告被医生修订后，不从头重跑 MultidisciplinaryTeam，
+    而是把上一版 MDT 输出和该报告的 diff 交给 integrator，只更新受影响的诊断。
+    报告没有变化（医生意见为 'None'）时直接返回上一版 MDT，不调用 LLM。
+    record(output, call) 和 budget 与 human_review 相同；预算已用完时返回上一版 MDT。
+    """
+    diff = report_diff(initial_text, revised_text)
+    if not diff.strip():
+        return previous_mdt
+
+    prompt = f"""
+The following is the previous multidisciplinary team (MDT) diagnosis.
+The {role_name} report it was based on has been revised after the doctor's feedback.
+
+Task:
+- Keep every diagnosis that is not affected by the change exactly as it is.
+- Update, replace or re-rank only the diagnoses affected by the change.
+- Keep the same format and output language as the previous MDT diagnosis.
+
+Previous MDT Diagnosis:
+{previous_mdt}
+
+Changes to the {role_name} report (unified diff, '-' removed lines, '+' added lines):
+{diff}
 """
-        final_version = llm.invoke(prompt)
-    return final_version
\ No newline at end of file
+    model = model or mdt_llm()
+    if budget is not None:
+        model = budget.model_for(model)
+    try:
+        updated_mdt, call = budgeted_invoke(budget, "MultidisciplinaryTeam", model, prompt)
+    except BudgetExceeded as e:
+        print(f"{e}; the MDT diagnosis was not updated.")
+        return previous_mdt
+    if record is not None:
+        record(updated_mdt, call)
+    return updated_mdt
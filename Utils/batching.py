@@ -0,0 +1,141 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+# ========== Micro-Batching ==========
+class MicroBatcher:
+    """
+    把多个线程里同时等待的 prompt 攒成一批，一次性交给支持批量推理的后端（backend.invoke_batch），
+    再把结果按顺序分发回各自的 Future。
+
+    对外和 LLMBackend 一样提供 invoke(prompt) 和 stream()，所以可以直接替换 agent.model。
+    后端不支持批量（supports_batch=False）时直接透传给 backend.invoke，不做额外等待。
+
+    收集线程只负责攒批，攒好的批交给线程池发送，最多 max_inflight 批同时在途：
+    一批还在等服务端时下一批照常收集和发送（vLLM 的 continuous batching 会在服务端继续合并）。
+    在途批数满时收集线程等待，这段时间新到的 prompt 留在队列里，下一批会更满。
+    """
+
+    def __init__(self, backend, max_batch_size=8, max_wait=0.05, max_inflight=4):
+        self.backend = backend
+        self.model_name = backend.model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait  # 收到第一条 prompt 后最多再等多久（秒）
+        self.max_inflight = max_inflight
+        self.batch_sizes = []
+        self._slots = threading.Semaphore(max_inflight)
+        self._executor = None
+        self._queue = queue.Queue()
+        self._closed = False
+        self._worker = None
+        if getattr(backend, "supports_batch", False):
+            self._executor = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="batch")
+            self._worker = threading.Thread(target=self._loop, daemon=True)
+            self._worker.start()
+
+    def submit(self, prompt):
+        future = Future()
+        if self._worker is None:
+            try:
+                future.set_result(self.backend.invoke(prompt))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+        self._queue.put((prompt, future))
+        return future
+
+    def invoke(self, prompt):
+        return self.submit(prompt).result()
+
+    def stream(self, prompt, max_tokens=None, json_schema=None):
+        """
+        结构化输出（invoke_structured）要带角色自己的 max_tokens 和 JSON schema 流式生成、JSON 闭合就停止，
+        这些请求没法合并进一批，直接交给后端，不经过批处理队列。
+        """
+        return self.backend.stream(prompt, max_tokens=max_tokens, json_schema=json_schema)
+
+    def close(self):
+        if self._worker is not None and not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._worker.join()
+            self._executor.shutdown(wait=True)
+
+    def _collect(self):
+        """
+        阻塞等到第一条请求，然后在 max_wait 窗口内继续收集，直到凑满 max_batch_size。
+        返回 (batch, stop)。
+        """
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _send(self, batch):
+        try:
+            outputs = self.backend.invoke_batch([prompt for prompt, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        for (_, future), output in zip(batch, outputs):
+            future.set_result(output)
+
+    def _loop(self):
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if not batch:
+                continue
+            self.batch_sizes.append(len(batch))
+            # 在途批数已满时在这里等，不阻塞正在发送的批
+            self._slots.acquire()
+            self._executor.submit(self._send, batch)
+
+
+# -------------------------
+# Shared batchers per role
+# -------------------------
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def shared_batcher(role, max_batch_size=8, max_wait=0.05, max_inflight=4, **backend_kwargs):
+    """
+    同一进程里同一角色共用一个 MicroBatcher，这样不同报告的同类 prompt 才能合并到一批。
+    backend_kwargs 在第一次创建时传给 get_backend（例如级联的小模型要指定 model_name）。
+    """
+    from Utils.llm_backends import get_backend
+
+    with _batchers_lock:
+        if role not in _batchers:
+            _batchers[role] = MicroBatcher(
+                get_backend(role, **backend_kwargs), max_batch_size=max_batch_size, max_wait=max_wait, max_inflight=max_inflight
+            )
+        return _batchers[role]
+
+
+def close_shared_batchers():
+    with _batchers_lock:
+        for batcher in _batchers.values():
+            batcher.close()
+        _batchers.clear()
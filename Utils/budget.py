@@ -0,0 +1,209 @@
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+
+from Utils.cascade import DEFAULT_SMALL_MODEL
+from Utils.llm_backends import get_backend, timed_invoke
+from Utils.structured_output import estimate_tokens
+
+# 用量达到上限的这些比例时逐级降级（累加）：先换小模型，再截断上下文，最后不带 RAG 内容
+DEGRADE_STEPS = (
+    (0.5, "small_model"),
+    (0.7, "trim_context"),
+    (0.85, "skip_rag"),
+)
+# trim_context 时每一段上下文（报告、RAG、工具输出、专科报告）最多保留的 token 数
+DEFAULT_TRIM_TOKENS = 600
+TRUNCATION_MARK = "\n[... truncated to stay within the report budget ...]"
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+@lru_cache(maxsize=None)
+def small_backend():
+    # 与 CascadeRouter 使用同一个小模型配置；所有报告的预算共用一个后端实例
+    return get_backend("Small", model_name=os.environ.get("LLM_MODEL_SMALL", DEFAULT_SMALL_MODEL))
+
+
+def trim_to_tokens(text, max_tokens):
+    """
+    按 estimate_tokens 的估计保留开头部分，超出时在末尾加截断标记。
+    """
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo] + TRUNCATION_MARK
+
+
+# ========== Per-Report Budget ==========
+class RunBudget:
+    """
+    一份报告（一次 pipeline 运行）的 token / 调用次数 / LLM 时间预算，
+    在 Agent.run、human_review 修订和 MDT 之间共享。
+
+    - check(role)          调用前检查，任一上限已用完时抛出 BudgetExceeded
+    - charge(role, call)   调用后按 timed_invoke 的调用信息记账（call=None 表示失败的调用，只计次数）
+    - model_for / trim / skip_rag   按当前降级等级选择模型、截断上下文、跳过 RAG
+
+    时间上限按 LLM 调用的累计耗时计算，不包含医生输入反馈或排队的时间；墙钟时间只写进报告。
+    上限为 None 表示不限制，只统计。
+    """
+
+    def __init__(self, max_tokens=None, max_calls=None, max_seconds=None, trim_tokens=DEFAULT_TRIM_TOKENS):
+        self.max_tokens = max_tokens
+        self.max_calls = max_calls
+        self.max_seconds = max_seconds
+        self.trim_tokens = trim_tokens
+        self.started = time.time()
+        self.tokens = 0
+        self.calls = 0
+        self.failed_calls = 0
+        # check() 之后、charge() 之前的调用；并发的专科调用也要计入调用次数上限
+        self.in_flight = 0
+        self.seconds = 0.0
+        self.by_role = {}
+        self.events = []
+        self.level = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        BUDGET_MAX_TOKENS / BUDGET_MAX_CALLS / BUDGET_MAX_SECONDS / BUDGET_TRIM_TOKENS，没设置的不限制。
+        """
+        def read(name, cast):
+            value = os.environ.get(name)
+            return cast(value) if value else None
+
+        return cls(
+            max_tokens=read("BUDGET_MAX_TOKENS", int),
+            max_calls=read("BUDGET_MAX_CALLS", int),
+            max_seconds=read("BUDGET_MAX_SECONDS", float),
+            trim_tokens=read("BUDGET_TRIM_TOKENS", int) or DEFAULT_TRIM_TOKENS,
+        )
+
+    def usage_fraction(self):
+        fractions = [0.0]
+        calls = self.calls + self.in_flight
+        for used, limit in ((self.tokens, self.max_tokens), (calls, self.max_calls), (self.seconds, self.max_seconds)):
+            if limit:
+                fractions.append(used / limit)
+        return max(fractions)
+
+    # -------------------------
+    # Enforcement
+    # -------------------------
+    def check(self, role):
+        with self.lock:
+            if self.usage_fraction() >= 1.0:
+                self.events.append({"time": time.time() - self.started, "role": role, "event": "exceeded"})
+                raise BudgetExceeded(
+                    f"Report budget exhausted before {role} call "
+                    f"(tokens {self.tokens}/{self.max_tokens}, calls {self.calls}/{self.max_calls}, "
+                    f"LLM seconds {self.seconds:.1f}/{self.max_seconds})"
+                )
+            self.in_flight += 1
+
+    def charge(self, role, call):
+        with self.lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            usage = self.by_role.setdefault(role, {"calls": 0, "failed_calls": 0, "tokens": 0, "seconds": 0.0, "models": []})
+            self.calls += 1
+            usage["calls"] += 1
+            if call is None:
+                self.failed_calls += 1
+                usage["failed_calls"] += 1
+            else:
+                tokens = (call.get("prompt_tokens") or 0) + (call.get("completion_tokens") or 0)
+                self.tokens += tokens
+                self.seconds += call.get("latency") or 0.0
+                usage["tokens"] += tokens
+                usage["seconds"] += call.get("latency") or 0.0
+                if call.get("model") and call["model"] not in usage["models"]:
+                    usage["models"].append(call["model"])
+
+            # 降级只升不降
+            fraction = self.usage_fraction()
+            while self.level < len(DEGRADE_STEPS) and fraction >= DEGRADE_STEPS[self.level][0]:
+                step = DEGRADE_STEPS[self.level][1]
+                self.level += 1
+                self.events.append({"time": time.time() - self.started, "role": role, "event": step, "usage": round(fraction, 3)})
+                print(f"[budget] {fraction:.0%} of report budget used after {role}: {step}")
+
+    # -------------------------
+    # Degradation
+    # -------------------------
+    def degraded(self, step):
+        return any(name == step for _, name in DEGRADE_STEPS[:self.level])
+
+    def model_for(self, model):
+        return small_backend() if self.degraded("small_model") else model
+
+    def trim(self, text):
+        return trim_to_tokens(text, self.trim_tokens) if self.degraded("trim_context") else text
+
+    @property
+    def skip_rag(self):
+        return self.degraded("skip_rag")
+
+    # -------------------------
+    # Report
+    # -------------------------
+    def report(self):
+        with self.lock:
+            return {
+                "limits": {"tokens": self.max_tokens, "calls": self.max_calls, "llm_seconds": self.max_seconds},
+                "used": {
+                    "tokens": self.tokens,
+                    "calls": self.calls,
+                    "failed_calls": self.failed_calls,
+                    "llm_seconds": round(self.seconds, 3),
+                    "wall_seconds": round(time.time() - self.started, 3),
+                },
+                "usage_fraction": round(self.usage_fraction(), 3),
+                "degradations": [name for _, name in DEGRADE_STEPS[:self.level]],
+                "by_role": self.by_role,
+                "events": self.events,
+            }
+
+    def summary(self):
+        report = self.report()
+        used = report["used"]
+        degraded = ", ".join(report["degradations"]) or "none"
+        return (
+            f"Budget: {used['tokens']} tokens, {used['calls']} calls ({used['failed_calls']} failed), "
+            f"{used['llm_seconds']:.1f}s LLM / {used['wall_seconds']:.1f}s wall, "
+            f"{report['usage_fraction']:.0%} of limit, degradations: {degraded}"
+        )
+
+    def write_report(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+
+def budgeted_invoke(budget, role, model, prompt, invoke=None):
+    """
+    timed_invoke 加上预算检查和记账；budget 为 None 时等同于 timed_invoke。
+    选哪个模型（model_for）由调用方决定，这里只负责 check / charge。
+    """
+    if budget is None:
+        return timed_invoke(model, prompt, invoke)
+    budget.check(role)
+    try:
+        output, call = timed_invoke(model, prompt, invoke)
+    except Exception:
+        budget.charge(role, None)
+        raise
+    budget.charge(role, call)
+    return output, call
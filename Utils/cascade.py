@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from Utils.llm_backends import get_backend
+from Utils.prompt_layout import prefix_fingerprint, user_fingerprint
+
+DEFAULT_SMALL_MODEL = "openai/gpt-oss-20b"
+DEFAULT_ROUTING_LOG = "results/routing_log.jsonl"
+
+# 追加在 system prompt 末尾（静态文本），让小模型自报置信度和是否有明显异常
+SELF_ASSESSMENT_INSTRUCTION = """After your answer, add exactly two final lines:
+CONFIDENCE: <a number between 0 and 1 for how confident you are in your assessment>
+SIGNIFICANT_FINDINGS: <yes or no>"""
+
+_CONFIDENCE_RE = re.compile(r"^\s*CONFIDENCE:\s*([0-9]*\.?[0-9]+)\s*$", re.MULTILINE | re.IGNORECASE)
+_FINDINGS_RE = re.compile(r"^\s*SIGNIFICANT_FINDINGS:\s*(yes|no)\s*$", re.MULTILINE | re.IGNORECASE)
+
+
+def small_model_name():
+    return os.environ.get("LLM_MODEL_SMALL", DEFAULT_SMALL_MODEL)
+
+
+def parse_self_assessment(text):
+    """
+    返回 (去掉自评行后的正文, confidence 或 None, significant_findings 或 None)。
+    """
+    confidence = None
+    findings = None
+    match = _CONFIDENCE_RE.search(text or "")
+    if match:
+        confidence = min(1.0, max(0.0, float(match.group(1))))
+    match = _FINDINGS_RE.search(text or "")
+    if match:
+        findings = match.group(1).lower() == "yes"
+    clean = _FINDINGS_RE.sub("", _CONFIDENCE_RE.sub("", text or "")).rstrip()
+    return clean, confidence, findings
+
+
+def with_self_assessment(messages):
+    system = messages[0]
+    return [{"role": system["role"], "content": f"{system['content']}\n\n{SELF_ASSESSMENT_INSTRUCTION}"}] + messages[1:]
+
+
+# ========== Cascade Router ==========
+class CascadeRouter:
+    """
+    专科 prompt 先交给小模型；以下任一信号触发时升级到大模型（gpt-oss-120b）：
+
+    - rule_flags：规则引擎（RAG_version/tools.py）已经发现异常，直接用大模型，不先试小模型
+    - low_confidence：小模型自报的 CONFIDENCE 低于阈值，或者没给出
+    - disagreement：规则引擎什么都没发现，小模型却说有明显异常，需要大模型复核
+
+    每次路由决策写一行 JSON 到 log_path，供 benchmarks/eval_cascade.py 离线分析。
+    """
+
+    def __init__(self, small, large, threshold=0.7, log_path=DEFAULT_ROUTING_LOG):
+        self.small = small
+        self.large = large
+        self.threshold = threshold
+        self.log_path = log_path
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_role(cls, role, small=None, large=None, **kwargs):
+        """
+        小模型由 LLM_BACKEND_SMALL / LLM_MODEL_SMALL 配置（默认 HF 上的 gpt-oss-20b），大模型沿用该角色的配置。
+        small / large 也可以直接传入已有的后端，例如 batch_main 里按角色共用的 MicroBatcher。
+        """
+        if small is None:
+            small = get_backend("Small", model_name=small_model_name())
+        return cls(small, large or get_backend(role), **kwargs)
+
+    @property
+    def model_name(self):
+        # 记录到 results store 时用来区分级联路由的输出
+        return f"cascade:{self.small.model_name}|{self.large.model_name}"
+
+    def decide(self, rule_flags, confidence, findings):
+        """
+        纯函数版本的路由规则，离线评估也用它。返回 (是否升级, 原因)。
+        """
+        if rule_flags:
+            return True, "rule_flags"
+        if confidence is None or confidence < self.threshold:
+            return True, "low_confidence"
+        if findings:
+            return True, "disagreement"
+        return False, "small_ok"
+
+    def run(self, role, messages, rule_flags=(), budget=None):
+        """
+        返回 (输出, 调用信息)。小模型和大模型的每次调用都单独经过 budgeted_invoke，
+        分别计入 budget 的调用次数、token 和延迟；调用信息是实际发生的调用的合计，供 results store 记录。
+        大模型调用被预算拒绝时退回小模型的输出（规则引擎直接升级、没有小模型输出时照常抛出 BudgetExceeded）。
+        """
+        # Utils/budget.py import 了本模块，这里延迟 import 避免循环
+        from Utils.budget import BudgetExceeded, budgeted_invoke
+
+        record = {
+            "timestamp": time.time(),
+            "role": role,
+            "report_hash": hashlib.sha256(messages[-1]["content"].encode("utf-8")).hexdigest()[:16],
+            "rule_flags": list(rule_flags),
+            "small_model": self.small.model_name,
+            "large_model": self.large.model_name,
+            "confidence": None,
+            "small_latency": None,
+            "large_latency": None,
+        }
+        calls = []
+        small_output = None
+
+        if rule_flags:
+            escalate, reason = self.decide(rule_flags, None, None)
+        else:
+            small_output, call = budgeted_invoke(budget, role, self.small, with_self_assessment(messages))
+            calls.append(call)
+            record["small_latency"] = call["latency"]
+            small_output, confidence, findings = parse_self_assessment(small_output)
+            record["confidence"] = confidence
+            escalate, reason = self.decide(rule_flags, confidence, findings)
+
+        output = small_output
+        if escalate:
+            try:
+                output, call = budgeted_invoke(budget, role, self.large, messages)
+                calls.append(call)
+                record["large_latency"] = call["latency"]
+            except BudgetExceeded:
+                if small_output is None:
+                    raise
+                escalate, reason = False, "budget_exceeded"
+
+        record["escalated"] = escalate
+        record["reason"] = reason
+        self.log(record)
+        print(f"[cascade] {role}: {'large' if escalate else 'small'} model ({reason})")
+        return output, {
+            "model": self.model_name,
+            "prompt_fingerprint": prefix_fingerprint(messages),
+            "user_fingerprint": user_fingerprint(messages),
+            "latency": sum(call["latency"] for call in calls),
+            "prompt_tokens": sum(call["prompt_tokens"] for call in calls),
+            "completion_tokens": sum(call["completion_tokens"] for call in calls),
+        }
+
+    def log(self, record):
+        if not self.log_path:
+            return
+        with self.lock:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
@@ -0,0 +1,210 @@
+import difflib
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from Utils.ingestion import normalize_report
+from Utils.budget import budgeted_invoke
+from RAG_version.tools import rule_flags
+
+DEFAULT_DEDUP_INDEX = "results/dedup_index.sqlite"
+
+# 模板化报告之间通常只差日期、时间、编号，先替换成占位符再比较。
+# 只替换确实像日期 / 编号的部分：检验值（血小板 250000、血压 150/95/80）必须保留，否则临床上不同的报告会被当成相同
+_DATE = re.compile(
+    r"(?<![\d/.])(?:"
+    r"\d{4}\s*[-/.年]\s*\d{1,2}\s*[-/.月]\s*\d{1,2}\s*日?"  # 2025-11-17 / 2025年11月17日
+    r"|\d{2}\s*年\s*\d{1,2}\s*月\s*\d{1,2}\s*日"  # 25年11月17日
+    r"|\d{1,2}/\d{1,2}/\d{4}"  # 11/17/2025
+    r")(?![\d/]|\.\d)"
+)
+# 时间：08:30、08:30:15、8:30 pm；不匹配 1:20 这类滴度 / 比例
+_TIME = re.compile(r"(?<![\d:])(?:[0-2]\d:[0-5]\d(?::[0-5]\d)?|\d:[0-5]\d\s*[ap]\.?m\b)(?![\d:])")
+# 带标签的编号（patient id: 345678、病历号：zy2025001）只替换值，保留标签
+_LABELLED_ID = re.compile(
+    r"((?:patient\s*id|\bid|\bmrn|medical record (?:no\.?|number)|病历号|住院号|门诊号|病案号|编号)\s*[:：#]?\s*)"
+    r"[a-z]*\d[a-z\d-]*"
+)
+# 字母前缀 + 长数字的编号（mrn00012345、zy2025001）
+_PREFIXED_ID = re.compile(r"\b[a-z]{1,4}-?\d{5,}\b")
+
+_MAX_HASH = (1 << 32) - 1
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def canonicalize(text):
+    text = normalize_report(text).lower()
+    text = _DATE.sub("<date>", text)
+    text = _TIME.sub("<time>", text)
+    text = _LABELLED_ID.sub(r"\1<id>", text)
+    text = _PREFIXED_ID.sub("<id>", text)
+    return re.sub(r"\s+", " ", text)
+
+
+def shingles(text, k=5):
+    """
+    字符级 k-gram，中英文都不需要分词。
+    """
+    if len(text) <= k:
+        return {text}
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+
+# ========== MinHash / LSH ==========
+class DedupIndex:
+    """
+    报告去重索引：canonicalize -> 字符 shingle -> MinHash 签名（num_perm 个哈希）-> LSH 分桶。
+
+    签名切成 bands 段、每段 num_perm / bands 行，任意一段完全相同就成为候选，
+    再用签名估计的 Jaccard 相似度确认。查询只看同桶的候选，与已索引的报告数量基本无关。
+
+    path 为 SQLite 文件时签名和报告文本会持久化（重启后重建内存里的桶）；":memory:" 时只在本进程内有效。
+    报告文本只存在 SQLite 里，命中时才读出来用于生成 diff。
+    """
+
+    def __init__(self, path=DEFAULT_DEDUP_INDEX, num_perm=128, bands=16, threshold=0.8, seed=1):
+        import numpy as np
+
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+        self.np = np
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        rng = np.random.RandomState(seed)
+        # a * h + b 在 uint64 内不会溢出：a < 2^31，h < 2^32
+        self.a = rng.randint(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 1 << 31, size=num_perm, dtype=np.uint64)
+
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.signatures = {}
+        self.metrics = {"queries": 0, "hits": 0, "indexed": 0, "seconds": 0.0}
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS reports (key TEXT PRIMARY KEY, signature BLOB NOT NULL, report TEXT NOT NULL)"
+        )
+        for key, blob in self.db.execute("SELECT key, signature FROM reports"):
+            self._insert(key, np.frombuffer(blob, dtype=np.uint32))
+
+    def signature(self, text):
+        np = self.np
+        start = time.perf_counter()
+        tokens = shingles(canonicalize(text))
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=4).digest(), "little") for t in tokens),
+            dtype=np.uint64,
+            count=len(tokens),
+        )
+        permuted = (np.outer(hashes, self.a) + self.b) % _MERSENNE_PRIME & _MAX_HASH
+        signature = permuted.min(axis=0).astype(np.uint32)
+        with self.lock:
+            self.metrics["seconds"] += time.perf_counter() - start
+        return signature
+
+    def _band_keys(self, signature):
+        return [(i, signature[i * self.rows:(i + 1) * self.rows].tobytes()) for i in range(self.bands)]
+
+    def _insert(self, key, signature):
+        self.signatures[key] = signature
+        for band_key in self._band_keys(signature):
+            self.buckets.setdefault(band_key, set()).add(key)
+
+    def query(self, text, signature=None):
+        """
+        返回 (key, 估计相似度)：相似度不低于 threshold 的最相近的已索引报告，没有则返回 None。
+        """
+        signature = self.signature(text) if signature is None else signature
+        start = time.perf_counter()
+        with self.lock:
+            candidates = set()
+            for band_key in self._band_keys(signature):
+                candidates |= self.buckets.get(band_key, set())
+            best = None
+            for key in candidates:
+                similarity = float((self.signatures[key] == signature).mean())
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (key, similarity)
+            self.metrics["queries"] += 1
+            self.metrics["hits"] += best is not None
+            self.metrics["seconds"] += time.perf_counter() - start
+        return best
+
+    def add(self, key, text, signature=None):
+        signature = self.signature(text) if signature is None else signature
+        with self.lock:
+            if key in self.signatures:
+                return
+            self._insert(key, signature)
+            self.db.execute("INSERT OR IGNORE INTO reports VALUES (?, ?, ?)", (key, signature.tobytes(), text))
+            self.db.commit()
+            self.metrics["indexed"] += 1
+
+    def report(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT report FROM reports WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def stats(self):
+        metrics = dict(self.metrics)
+        metrics["size"] = len(self)
+        metrics["hit_rate"] = metrics["hits"] / metrics["queries"] if metrics["queries"] else 0.0
+        # seconds 包含计算签名和查桶的时间
+        metrics["queries_per_second"] = metrics["queries"] / metrics["seconds"] if metrics["seconds"] else 0.0
+        return metrics
+
+
+def same_clinical_content(previous_report, medical_report):
+    """
+    能否直接复用之前的 MDT 结果：canonicalize 之后完全相同（差别只在日期、时间、编号），
+    并且规则引擎的异常项也一样。MinHash 相似度再高也不够——改一个心率数值相似度仍可能是 1.00。
+    """
+    if canonicalize(previous_report) != canonicalize(medical_report):
+        return False
+    return all(
+        rule_flags(previous_report, role) == rule_flags(medical_report, role)
+        for role in ("Cardiologist", "Psychologist")
+    )
+
+
+# -------------------------
+# Light revision of a prior MDT
+# -------------------------
+def revise_for_near_duplicate(previous_mdt, previous_report, medical_report, model, budget=None):
+    """
+    新报告和之前分析过的报告几乎相同时，不重跑专科和 MDT，
+    只把两份报告的 diff 和上一份 MDT 诊断交给模型，让它改动受影响的部分。
+    返回 (更新后的诊断, 调用信息)；调用计入 budget（可选）。
+    """
+    diff = "\n".join(difflib.unified_diff(
+        previous_report.splitlines(), medical_report.splitlines(),
+        fromfile="previous", tofile="new", n=0, lineterm="",
+    ))
+    prompt = f"""
+The following multidisciplinary team (MDT) diagnosis was written for a previous medical report.
+A new report is nearly identical to that one; the differences are listed below.
+
+Task:
+- Keep every diagnosis that the differences do not affect exactly as it is.
+- Update only what the differences change (dates and identifiers alone do not change a diagnosis).
+- Keep the same format and output language as the previous MDT diagnosis.
+
+Previous MDT Diagnosis:
+{previous_mdt}
+
+Differences between the previous and the new report (unified diff, '-' previous, '+' new):
+{diff}
+"""
+    if budget is not None:
+        model = budget.model_for(model)
+    return budgeted_invoke(budget, "MultidisciplinaryTeam", model, prompt)
@@ -0,0 +1,185 @@
+import glob
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import unicodedata
+
+# 报告文件可能来自不同系统：UTF-8（可能带 BOM）或国内常见的 GBK/GB18030
+ENCODINGS = ("utf-8-sig", "gb18030")
+_INVISIBLE = re.compile("[\u200b\u200c\u200d\u2060\ufeff]")
+_SPACES = re.compile("[ \t\f\v\u00a0\u3000]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+# ========== Normalization ==========
+def decode_report(data):
+    for encoding in ENCODINGS:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="replace")
+
+
+def normalize_report(text):
+    """
+    统一编码和空白：NFKC（全角字母、数字和标点转半角）、去掉零宽字符、统一换行、
+    行内连续空白合并成一个空格、去掉行尾空白、最多保留一个空行。
+    同一份报告不管从哪个来源读入，得到的文本（和 results store 里的 report_hash）都一样。
+    """
+    text = unicodedata.normalize("NFKC", text)
+    text = _INVISIBLE.sub("", text)
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    lines = [_SPACES.sub(" ", line).strip() for line in text.split("\n")]
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+
+def read_report(path):
+    with open(path, "rb") as file:
+        return normalize_report(decode_report(file.read()))
+
+
+# ========== Sources ==========
+# 每个来源都是生成器，逐条产出 (report_name, text)，不会把整个 feed 读进内存
+def iter_jsonl(path, text_field="report", id_field="id"):
+    """
+    每行一个 JSON 对象，报告正文在 text_field，名字取 id_field（没有时用 文件名:行号）。
+    path 为 "-" 时读 stdin。
+    """
+    stream = sys.stdin.buffer if path == "-" else open(path, "rb")
+    base = "stdin" if path == "-" else os.path.splitext(os.path.basename(path))[0]
+    try:
+        for lineno, raw in enumerate(stream, 1):
+            line = decode_report(raw).strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping {base}:{lineno}: invalid JSON ({e})")
+                continue
+            text = record.get(text_field) if isinstance(record, dict) else None
+            if not text:
+                print(f"Skipping {base}:{lineno}: no '{text_field}' field")
+                continue
+            yield str(record.get(id_field) or f"{base}:{lineno}"), normalize_report(text)
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+
+
+def iter_stdin(text_field="report", id_field="id"):
+    yield from iter_jsonl("-", text_field, id_field)
+
+
+def iter_directory(path, pattern="*.txt", watch=False, poll_interval=1.0, settle=0.5):
+    """
+    按文件名顺序产出目录里的报告。watch=True 时持续轮询新文件（Ctrl+C 结束），按到达顺序产出；
+    到达时间不足 settle 秒的文件可能还在写入，留到下一轮再读。
+
+    watch 模式不记住每个读过的文件，只记一个高水位 (到达时间, 文件路径)，长时间运行内存也不增长。
+    到达时间取 mtime 和 ctime 中较大的一个：mv 或 cp -p 进来的文件 mtime 可能很旧，ctime 是进入目录的时间。
+    每一轮只处理到达时间早于 now - settle 的文件，之后到达的文件一定排在高水位之后；被改写过的文件会再处理一次。
+    """
+    if not watch:
+        for file_path in sorted(glob.glob(os.path.join(path, pattern))):
+            try:
+                text = read_report(file_path)
+            except OSError as e:
+                print(f"Skipping {file_path}: {e}")
+                continue
+            yield os.path.splitext(os.path.basename(file_path))[0], text
+        return
+
+    mark = (0.0, "")
+    while True:
+        cutoff = time.time() - settle
+        ready = []
+        for file_path in glob.glob(os.path.join(path, pattern)):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            key = (max(stat.st_mtime, stat.st_ctime), file_path)
+            if key[0] <= cutoff and key > mark:
+                ready.append(key)
+        for key in sorted(ready):
+            mark = key
+            try:
+                text = read_report(key[1])
+            except OSError as e:
+                print(f"Skipping {key[1]}: {e}")
+                continue
+            yield os.path.splitext(os.path.basename(key[1]))[0], text
+        time.sleep(poll_interval)
+
+
+def iter_sources(paths, watch=False, pattern="*.txt"):
+    """
+    按类型分派："-" 读 stdin（JSONL），.jsonl 文件，目录（可 watch），其余当作单份报告文件。
+    """
+    for path in paths:
+        if path == "-":
+            yield from iter_stdin()
+        elif os.path.isdir(path):
+            yield from iter_directory(path, pattern, watch=watch)
+        elif path.endswith(".jsonl"):
+            yield from iter_jsonl(path)
+        else:
+            yield os.path.splitext(os.path.basename(path))[0], read_report(path)
+
+
+# ========== Bounded Pipeline ==========
+_DONE = object()
+
+
+def process_stream(source, handler, workers=4, queue_size=None):
+    """
+    一个生产者线程从 source 读报告放进有界队列，workers 个线程取出后调用 handler(report_name, text)。
+
+    队列满时生产者的 put() 会阻塞：LLM 阶段处理不过来，读取也随之放慢，
+    内存里最多只有 queue_size + workers 份报告，与 feed 的总长度无关。
+    handler 抛出的异常只影响当前报告。返回 processed / failed / elapsed 统计。
+    """
+    feed = queue.Queue(maxsize=queue_size or 2 * workers)
+    stats = {"processed": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def produce():
+        try:
+            for item in source:
+                feed.put(item)
+        except Exception as e:
+            print(f"Ingestion stopped: {e}")
+        finally:
+            for _ in range(workers):
+                feed.put(_DONE)
+
+    def consume():
+        while True:
+            item = feed.get()
+            if item is _DONE:
+                return
+            report_name, text = item
+            try:
+                handler(report_name, text)
+                key = "processed"
+            except Exception as e:
+                print(f"Failed to process {report_name}: {e}")
+                key = "failed"
+            with lock:
+                stats[key] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=produce, daemon=True)]
+    threads += [threading.Thread(target=consume, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats["elapsed"] = time.perf_counter() - start
+    return stats
@@ -0,0 +1,129 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from Utils.budget import BudgetExceeded, budgeted_invoke
+from Utils.llm_backends import get_backend
+from Utils.prompt_layout import LANGUAGE_NAMES, working_language
+
+DEFAULT_TRANSLATION_CACHE = "results/translation_cache.sqlite"
+
+
+# ========== Language Detection ==========
+def detect_language(text, cjk_ratio=0.2):
+    """
+    很轻量的检测：中日韩字符占所有字母类字符的比例超过 cjk_ratio 就当作中文，否则英文。
+    中文病历里常夹着英文缩写和检验项目名（ECG、TnI），所以阈值不取 0.5。
+    """
+    letters = [ch for ch in text or "" if ch.isalpha()]
+    if not letters:
+        return working_language()
+    cjk = sum(1 for ch in letters if "\u3400" <= ch <= "\u9fff" or "\uf900" <= ch <= "\ufaff")
+    return "zh" if cjk / len(letters) >= cjk_ratio else "en"
+
+
+def output_language(medical_report, setting=None):
+    """
+    最终结果的语言：OUTPUT_LANGUAGE=auto（默认）跟随报告语言，none 保持工作语言，也可以直接写 zh / en。
+    """
+    setting = (setting or os.environ.get("OUTPUT_LANGUAGE", "auto")).lower()
+    if setting == "auto":
+        return detect_language(medical_report)
+    if setting == "none":
+        return working_language()
+    return setting
+
+
+# ========== Cached Translator ==========
+class Translator:
+    """
+    只在流程最后翻译一次最终文本。后端是 "Translator" 角色（LLM_BACKEND_TRANSLATOR / LLM_MODEL_TRANSLATOR），
+    可以指向本地 OpenAI 兼容服务上的小模型，不占用主模型。
+
+    (模型, 目标语言, 文本哈希) -> 译文 缓存在内存 LRU 里；给了 cache_path 时还会写进 SQLite，
+    同一段 MDT 结果再次导出或医生重复要求翻译时不会重新调用模型。
+    """
+
+    def __init__(self, backend=None, cache_path=DEFAULT_TRANSLATION_CACHE, max_cache=1000):
+        self.backend = backend
+        self.max_cache = max_cache
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        if cache_path:
+            os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(cache_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "model TEXT, target TEXT, text_hash TEXT, translation TEXT, "
+                "PRIMARY KEY (model, target, text_hash))"
+            )
+
+    def _backend(self):
+        if self.backend is None:
+            self.backend = get_backend("Translator")
+        return self.backend
+
+    def _cached(self, key):
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        if self.db is not None:
+            row = self.db.execute(
+                "SELECT translation FROM translations WHERE model = ? AND target = ? AND text_hash = ?", key
+            ).fetchone()
+            if row is not None:
+                self._remember(key, row[0])
+                return row[0]
+        return None
+
+    def _remember(self, key, translation):
+        self.cache[key] = translation
+        if len(self.cache) > self.max_cache:
+            self.cache.popitem(last=False)
+
+    def translate(self, text, target, budget=None):
+        """
+        把 text 翻译成 target（zh / en），返回 (译文, 调用信息)；没有调用模型时调用信息为 None。
+        已经是目标语言、为空、命中缓存，或者 budget 已用完时都不调用模型。
+        翻译失败（后端或网络出错）时打印原因并返回原文，不影响调用方写出结果和结束这次运行。
+        """
+        if not text or detect_language(text) == target:
+            return text, None
+        keeping = f"keeping the {LANGUAGE_NAMES.get(working_language(), working_language())} text."
+        try:
+            backend = self._backend()
+        except Exception as e:
+            print(f"Translation failed: {e}; {keeping}")
+            return text, None
+        key = (backend.model_name, target, hashlib.sha256(text.encode("utf-8")).hexdigest())
+        with self.lock:
+            cached = self._cached(key)
+            if cached is not None:
+                self.hits += 1
+                return cached, None
+            self.misses += 1
+
+        prompt = f"""Translate the following medical text into {LANGUAGE_NAMES.get(target, target)}.
+Keep the structure, numbering and line breaks. Translate medical terms accurately and keep drug names, units and lab values unchanged.
+Output only the translation.
+
+{text}"""
+        try:
+            translation, call = budgeted_invoke(budget, "Translator", backend, prompt)
+        except BudgetExceeded as e:
+            print(f"{e}; {keeping}")
+            return text, None
+        except Exception as e:
+            print(f"Translation failed: {e}; {keeping}")
+            return text, None
+        with self.lock:
+            self._remember(key, translation)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)", (*key, translation))
+                self.db.commit()
+        return translation, call
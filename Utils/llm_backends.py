@@ -0,0 +1,293 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from Utils.prompt_layout import prefix_fingerprint, user_fingerprint
+from Utils.structured_output import estimate_tokens
+
+# 默认模型：没有任何配置时所有角色都走 HF Inference 上的 gpt-oss-120b
+DEFAULT_BACKEND = "hf"
+DEFAULT_MODEL = "openai/gpt-oss-120b"
+DEFAULT_OPENAI_BASE_URL = "http://localhost:8000/v1"
+
+
+# ========== Backend Interface ==========
+class LLMBackend:
+    """
+    所有 LLM 后端的统一接口：invoke(prompt) -> str。
+    prompt 可以是纯文本，也可以是 build_messages() 生成的 chat messages。
+    """
+    name = None
+    # 是否支持一次请求里提交多个 prompt（见 Utils/batching.py）
+    supports_batch = False
+
+    def __init__(self, model_name=DEFAULT_MODEL, temperature=0, max_tokens=800):
+        self.model_name = model_name
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        # 最近一次调用的 token 统计，按线程保存（同一个后端会被多个线程共享）
+        self._usage = threading.local()
+
+    def last_usage(self):
+        """
+        返回当前线程最近一次 invoke 的 (prompt_tokens, completion_tokens)，后端拿不到时返回 None。
+        """
+        return getattr(self._usage, "value", None)
+
+    def _set_usage(self, prompt_tokens, completion_tokens):
+        self._usage.value = (prompt_tokens, completion_tokens)
+
+    @staticmethod
+    def to_messages(prompt):
+        return prompt if isinstance(prompt, list) else [{"role": "user", "content": prompt}]
+
+    def invoke(self, prompt):
+        raise NotImplementedError
+
+    def invoke_batch(self, prompts):
+        return [self.invoke(prompt) for prompt in prompts]
+
+    def stream(self, prompt, max_tokens=None, json_schema=None):
+        """
+        逐块返回输出文本。调用方可以提前 close() 生成器来停止生成（见 Utils/structured_output.py）。
+        默认实现不支持流式，一次性返回完整结果。
+        """
+        yield self.invoke(prompt)
+
+
+def json_response_format(json_schema, name="output"):
+    # OpenAI 风格的 response_format，HF Inference 与 vLLM 都接受
+    return {"type": "json_schema", "json_schema": {"name": name, "schema": json_schema, "strict": True}}
+
+
+# ========== HuggingFace Inference ==========
+class HFInferenceBackend(LLMBackend):
+    """
+    A simple wrapper to replicate ChatOpenAI-style interface using HuggingFace InferenceClient.
+    """
+    name = "hf"
+
+    def __init__(self, model_name=DEFAULT_MODEL, temperature=0, max_tokens=800):
+        super().__init__(model_name, temperature, max_tokens)
+        # 重量级依赖在真正创建后端时才 import，缩短短命令的启动时间
+        from huggingface_hub import InferenceClient
+
+        self.client = InferenceClient(model_name) # InferenceClient 默认会去查找环境变量：默认读取 os.environ["HF_TOKEN"]
+
+    def invoke(self, prompt):
+        response = self.client.chat_completion(
+            messages=self.to_messages(prompt),
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+        )
+        if getattr(response, "usage", None) is not None:
+            self._set_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+        # HuggingFace returns: response.choices[0].message
+        return response.choices[0].message["content"]
+
+    def stream(self, prompt, max_tokens=None, json_schema=None):
+        kwargs = {}
+        if json_schema is not None:
+            kwargs["response_format"] = json_response_format(json_schema)
+        chunks = self.client.chat_completion(
+            messages=self.to_messages(prompt),
+            max_tokens=max_tokens or self.max_tokens,
+            temperature=self.temperature,
+            stream=True,
+            **kwargs,
+        )
+        for chunk in chunks:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+# 兼容旧代码里的名字
+HFChatModel = HFInferenceBackend
+
+
+# ========== OpenAI-Compatible Endpoint ==========
+class OpenAICompatibleBackend(LLMBackend):
+    """
+    任意 OpenAI 兼容的 /v1/chat/completions 服务：本地 vLLM、llama.cpp server，或 OpenAI 本身。
+
+    batch=True 时（或环境变量 LLM_BATCH=1），invoke_batch 会把多条对话渲染成文本 prompt，
+    用一次 /v1/completions 请求（prompt 为列表）提交，vLLM 会在服务端一起调度。
+    """
+    name = "openai"
+
+    def __init__(self, model_name=DEFAULT_MODEL, temperature=0, max_tokens=800, base_url=None, api_key=None, batch=None):
+        super().__init__(model_name, temperature, max_tokens)
+        from langchain_openai import ChatOpenAI
+
+        if batch is None:
+            batch = os.environ.get("LLM_BATCH", "0") == "1"
+        self.supports_batch = batch
+        self._tokenizer = None
+
+        self.base_url = base_url or os.environ.get("OPENAI_BASE_URL", DEFAULT_OPENAI_BASE_URL)
+        self.client = ChatOpenAI(
+            model=model_name,
+            base_url=self.base_url,
+            # 本地服务通常不校验 key，但 ChatOpenAI 要求必须有值
+            api_key=api_key or os.environ.get("OPENAI_API_KEY", "EMPTY"),
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+
+    def invoke(self, prompt):
+        message = self.client.invoke(self.to_messages(prompt))
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            self._set_usage(usage.get("input_tokens"), usage.get("output_tokens"))
+        return message.content
+
+    def stream(self, prompt, max_tokens=None, json_schema=None):
+        kwargs = {"max_tokens": max_tokens or self.max_tokens}
+        if json_schema is not None:
+            kwargs["response_format"] = json_response_format(json_schema)
+        for chunk in self.client.stream(self.to_messages(prompt), **kwargs):
+            if chunk.content:
+                yield chunk.content
+
+    def chat_tokenizer(self):
+        """
+        /v1/completions 不会套 chat template，只能在客户端用模型自带的 tokenizer 渲染（需要 transformers）。
+        拿不到时返回 None，不去猜一个模型没训练过的格式。
+        """
+        if self._tokenizer is None:
+            try:
+                from transformers import AutoTokenizer
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            except Exception as e:
+                print(f"No chat template for {self.model_name} ({e}); sending batched prompts as separate chat requests.")
+                self._tokenizer = False
+        return self._tokenizer or None
+
+    def render_chat(self, messages):
+        return self.chat_tokenizer().apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+    def invoke_batch(self, prompts):
+        if not self.supports_batch:
+            return super().invoke_batch(prompts)
+        if self.chat_tokenizer() is None:
+            # 逐条走 /v1/chat/completions（服务端套模板），并发发送，vLLM 仍会在服务端合并调度
+            with ThreadPoolExecutor(max_workers=len(prompts)) as pool:
+                return list(pool.map(self.invoke, prompts))
+        response = self.client.root_client.completions.create(
+            model=self.model_name,
+            prompt=[self.render_chat(self.to_messages(prompt)) for prompt in prompts],
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+        )
+        # 按 choice.index 把结果分回对应的 prompt
+        outputs = [None] * len(prompts)
+        for choice in response.choices:
+            outputs[choice.index] = choice.text
+        return outputs
+
+
+# ========== In-Process Stub ==========
+class StubBackend(LLMBackend):
+    """
+    不发任何网络请求的后端，用于离线调试流程。
+    response 可以是固定字符串，也可以是 callable(messages) -> str；默认回显 user message 的开头。
+    """
+    name = "stub"
+    supports_batch = True
+
+    def __init__(self, model_name="stub", temperature=0, max_tokens=800, response=None):
+        super().__init__(model_name, temperature, max_tokens)
+        self.response = response
+        self.calls = []
+        self.batches = []
+
+    def invoke(self, prompt):
+        messages = self.to_messages(prompt)
+        self.calls.append(messages)
+        if callable(self.response):
+            return self.response(messages)
+        if self.response is not None:
+            return self.response
+        return f"[stub:{self.model_name}] {messages[-1]['content'][:200]}"
+
+    def invoke_batch(self, prompts):
+        self.batches.append(len(prompts))
+        return [self.invoke(prompt) for prompt in prompts]
+
+
+# -------------------------
+# Call metadata
+# -------------------------
+def timed_invoke(model, prompt, invoke=None):
+    """
+    调用 model.invoke(prompt)，返回 (输出, 调用信息)。调用信息由 Utils/results_store.py 记录：
+    model、prompt_fingerprint、user_fingerprint、latency（秒）、prompt_tokens、completion_tokens。
+
+    invoke 可以替换实际的调用函数（例如 CascadeRouter.run 或 invoke_structured），model 只用来取名字和 usage。
+    后端能拿到服务端统计的 usage 时用真实值，否则按字符数估计。
+    """
+    messages = LLMBackend.to_messages(prompt)
+    if hasattr(model, "_usage"):
+        model._usage.value = None
+    start = time.perf_counter()
+    output = (invoke or model.invoke)(messages)
+    latency = time.perf_counter() - start
+
+    usage = model.last_usage() if hasattr(model, "last_usage") else None
+    if usage is None:
+        text = output if isinstance(output, str) else json.dumps(output, ensure_ascii=False)
+        usage = (
+            sum(estimate_tokens(message["content"]) for message in messages),
+            estimate_tokens(text or "") if output is not None else 0,
+        )
+    return output, {
+        "model": getattr(model, "model_name", None),
+        "prompt_fingerprint": prefix_fingerprint(messages),
+        "user_fingerprint": user_fingerprint(messages),
+        "latency": latency,
+        "prompt_tokens": usage[0],
+        "completion_tokens": usage[1],
+    }
+
+
+BACKENDS = {
+    "hf": HFInferenceBackend,
+    "openai": OpenAICompatibleBackend,
+    "stub": StubBackend,
+}
+
+
+# -------------------------
+# Per-role backend selection
+# -------------------------
+def _role_setting(name, role, default=None):
+    """
+    先读角色专属的环境变量（如 LLM_BACKEND_CARDIOLOGIST），再读全局的（LLM_BACKEND）。
+    """
+    if role:
+        value = os.environ.get(f"{name}_{role.upper()}")
+        if value:
+            return value
+    return os.environ.get(name, default)
+
+
+def get_backend(role=None, backend=None, model_name=None, **kwargs):
+    """
+    按角色创建 LLM 后端。配置来自环境变量（可以写在 hf.env 里）：
+
+        LLM_BACKEND=hf                                  # 全局默认：hf / openai / stub
+        LLM_BACKEND_CARDIOLOGIST=openai                 # 某个角色单独走本地模型
+        LLM_MODEL_CARDIOLOGIST=Qwen/Qwen2.5-7B-Instruct
+        LLM_BASE_URL_CARDIOLOGIST=http://localhost:8000/v1
+
+    显式传入的 backend / model_name 优先于环境变量。
+    """
+    backend = backend or _role_setting("LLM_BACKEND", role, DEFAULT_BACKEND)
+    model_name = model_name or _role_setting("LLM_MODEL", role, DEFAULT_MODEL)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{backend}', expected one of {sorted(BACKENDS)}")
+    if backend == "openai" and "base_url" not in kwargs:
+        kwargs["base_url"] = _role_setting("LLM_BASE_URL", role)
+    return BACKENDS[backend](model_name=model_name, **kwargs)
@@ -1,98 +1,48 @@
 import os
 from dotenv import load_dotenv
-from langchain_core.prompts import PromptTemplate
-from huggingface_hub import InferenceClient
-
-# ========== HF Model Wrapper (LangChain-Compatible) ==========
-class HFChatModel:
-    """
-    A simple wrapper to replicate ChatOpenAI-style interface using HuggingFace InferenceClient.
-    """
-    def __init__(self, model_name="openai/gpt-oss-120b", temperature=0):
-        self.client = InferenceClient(model_name) # InferenceClient 默认会去查找环境变量：默认读取 os.environ["HF_TOKEN"]
-        self.temperature = temperature
-
-    def invoke(self, prompt):
-        response = self.client.chat_completion(
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=800,
-            temperature=self.temperature,
-        )
-        # HuggingFace returns: response.choices[0].message
-        return response.choices[0].message["content"]
-    
+from Utils.prompt_layout import PROMPT_TEMPLATES, build_messages, build_system_prompt
+from Utils.llm_backends import get_backend
+from Utils.budget import budgeted_invoke
+from Utils.structured_output import invoke_structured, schema_instruction
 
 class Agent:
     def __init__(self, medical_report=None, role=None, extra_info=None):
         self.medical_report = medical_report
         self.role = role
         self.extra_info = extra_info
+        self.system_prompt = build_system_prompt(role)
         self.prompt_template = self.create_prompt_template()
 
-        self.model = HFChatModel(
-            model_name="openai/gpt-oss-120b",
-            temperature=0
-        )
+        # 可选的 CascadeRouter（Utils/cascade.py）和规则引擎给出的异常项
+        self.router = None
+        self.rule_flags = ()
+        # 最近一次调用的模型、延迟和 token 数，供 Utils/results_store.py 记录
+        self.last_call = None
+        # 可选的 RunBudget（Utils/budget.py），同一份报告的所有 agent 共享
+        self.budget = None
+
+        # 每个角色可以单独配置后端（见 Utils/llm_backends.py），默认仍是 HF 上的 gpt-oss-120b
+        self.model = get_backend(role)
 
     
     def create_prompt_template(self):
-        # --- Integrator Agent (MDT) ---
-        if self.role == "MultidisciplinaryTeam":
-            template = f"""
-                Act like a multidisciplinary team consisting of a Cardiologist and a Psychologist.
-
-                Task:
-                - Integrate both specialist reports.
-                - Provide exactly **3 possible diagnoses**.
-                - For each diagnosis, explain briefly:
-                    1. Why this diagnosis is plausible
-                    2. Whether the cause is cardiac, psychological, or mixed.
-
-                Output:
-                - Bullet list with 3 items.
-                - translate the final output to Chinese.
-
-                Cardiologist Report:
-                {self.extra_info.get('cardiologist_report', '')}
-
-                Psychologist Report:
-                {self.extra_info.get('psychologist_report', '')}
-            """
-            return PromptTemplate.from_template(template)
-
-        # --- Specialist Agents ---
-        templates = {
-            "Cardiologist": """
-                Act like a cardiologist.
-
-                Task:
-                - Analyze the patient's ECG, labs, symptoms, and cardiac history.
-                - Identify possible cardiac causes: arrhythmias, coronary issues, structural problems.
-                - Recommend next steps (tests, monitoring).
-
-                Output:
-                - Cardiac causes + recommended next steps.
-
-                Medical Report:
-                {medical_report}
-            """,
+        # 静态的角色说明在 system message 里，每份报告不同的部分用 Utils/prompt_layout.py 里预编译好的模板
+        return PROMPT_TEMPLATES[self.role]
 
-            "Psychologist": """
-                Act like a psychologist.
-
-                Task:
-                - Analyze emotional and behavioral symptoms.
-                - Identify possible mental health issues: anxiety, depression, trauma, stress-related disorders.
-                - Recommend next steps.
+    def format_user_content(self):
+        # 预算紧张时每段上下文都会被截断
+        trim = self.budget.trim if self.budget is not None else (lambda text: text)
+        if self.role == "MultidisciplinaryTeam":
+            return self.prompt_template.format(**{key: trim(value) for key, value in self.extra_info.items()})
+        return self.prompt_template.format(medical_report=trim(self.medical_report))
 
-                Output:
-                - Possible psychological issues + next steps.
+    def input_messages(self, system_prompt=None):
+        # run() / run_structured() 发送的消息；ResultsStore.lookup_agent 用它判断输入是否完全相同
+        return build_messages(system_prompt or self.system_prompt, [(None, self.format_user_content())])
 
-                Patient Report:
-                {medical_report}
-            """
-        }
-        return PromptTemplate.from_template(templates[self.role])
+    def select_model(self):
+        # 预算用掉一半后改用小模型（此时也不再走 cascade 路由）
+        return self.budget.model_for(self.model) if self.budget is not None else self.model
 
 
     # -------------------------
@@ -101,18 +51,42 @@ class Agent:
     def run(self):
         print(f"{self.role} is running...")
 
-        if self.role == "MultidisciplinaryTeam":
-            prompt = self.prompt_template.format()
-        else:
-            prompt = self.prompt_template.format(medical_report=self.medical_report)
+        messages = self.input_messages()
 
         try:
-            response = self.model.invoke(prompt)
+            model = self.select_model()
+            if self.router is not None and model is self.model:
+                # 级联可能调用两次模型，由 router 按每次调用分别计入预算
+                response, self.last_call = self.router.run(self.role, messages, rule_flags=self.rule_flags, budget=self.budget)
+            else:
+                response, self.last_call = budgeted_invoke(self.budget, self.role, model, messages)
             return response
         except Exception as e:
             print("Error occurred:", e)
             return None
 
+    def run_structured(self, budgets=None):
+        """
+        结构化输出版本的 run()：返回按 ROLE_SCHEMAS 校验过的 dict，失败时返回 None。
+        max_tokens 由各角色的历史输出长度决定，JSON 对象一闭合就停止生成。
+        不支持级联路由（小模型的自评行和 JSON 输出格式冲突），设置了 router 时直接报错。
+        """
+        if self.router is not None:
+            raise ValueError("Structured output does not support cascade routing")
+        print(f"{self.role} is running (structured)...")
+
+        messages = self.input_messages(build_system_prompt(self.role, output_format=schema_instruction(self.role)))
+
+        try:
+            model = self.select_model()
+            data, self.last_call = budgeted_invoke(
+                self.budget, self.role, model, messages, lambda m: invoke_structured(model, m, self.role, budgets)
+            )
+            return data
+        except Exception as e:
+            print("Error occurred:", e)
+            return None
+
 
 
 # ========== Specialized Agents ==========
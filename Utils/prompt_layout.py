@@ -0,0 +1,147 @@
+import hashlib
+import os
+from functools import lru_cache
+from string import Formatter
+
+# ========== Static Role Instructions ==========
+# 这些说明对同一个角色永远不变，放在 system message 里作为固定前缀，
+# 这样服务端（vLLM / llama.cpp 等）的 prefix / KV cache 可以在不同报告之间复用。
+ROLE_INSTRUCTIONS = {
+    "Cardiologist": """Act like a cardiologist.
+
+Task:
+- Analyze the patient's ECG, labs, symptoms, and cardiac history.
+- Identify possible cardiac causes: arrhythmias, coronary issues, structural problems.
+- Recommend next steps (tests, monitoring).
+
+Output:
+- Cardiac causes + recommended next steps.""",
+
+    "Psychologist": """Act like a psychologist.
+
+Task:
+- Analyze emotional and behavioral symptoms.
+- Identify possible mental health issues: anxiety, depression, trauma, stress-related disorders.
+- Recommend next steps.
+
+Output:
+- Possible psychological issues + next steps.""",
+
+    "MultidisciplinaryTeam": """Act like a multidisciplinary team consisting of a Cardiologist and a Psychologist.
+
+Task:
+- Integrate both specialist reports.
+- Provide exactly **3 possible diagnoses**.
+- For each diagnosis, explain briefly:
+    1. Why this diagnosis is plausible
+    2. Whether the cause is cardiac, psychological, or mixed.
+
+Output:
+- Bullet list with 3 items.""",
+}
+
+# 所有 agent 都用同一种工作语言推理和输出，不在每次调用里顺带翻译；
+# 需要其他语言时只在最后翻译一次最终结果（见 Utils/language.py）
+LANGUAGE_NAMES = {"en": "English", "zh": "Chinese"}
+
+
+def working_language():
+    # 每次调用时读环境变量：入口脚本先 import 再 load_dotenv，import 时读会拿不到 env 文件里的设置
+    return os.environ.get("WORKING_LANGUAGE", "en")
+
+
+def revision_language_instruction(language=None):
+    # 修订 prompt 没有 system prompt，医生用中文写意见时也要保持工作语言
+    language = language or working_language()
+    return f"Write the revised report in {LANGUAGE_NAMES.get(language, language)}, whatever the language of the feedback."
+
+
+def build_system_prompt(role, extra_output=(), output_format=None, language=None):
+    """
+    返回某个角色的固定 system prompt。extra_output 是各版本额外的输出要求（tuple，也必须是静态文本）。
+    output_format 不为空时替换掉原来的 Output 部分（例如结构化 JSON 输出）。
+    language 是工作语言（默认 WORKING_LANGUAGE）：不管报告是什么语言，都用它来写输出。
+    结果按参数缓存，每个进程只拼接一次。
+    """
+    return _build_system_prompt(role, extra_output, output_format, language or working_language())
+
+
+@lru_cache(maxsize=None)
+def _build_system_prompt(role, extra_output, output_format, language):
+    system_prompt = ROLE_INSTRUCTIONS[role]
+    if output_format is not None:
+        system_prompt = system_prompt.split("\n\nOutput:")[0] + f"\n\nOutput:\n{output_format}"
+    for line in extra_output:
+        system_prompt += f"\n- {line}"
+    system_prompt += f"\n- Write in {LANGUAGE_NAMES.get(language, language)}, whatever the language of the report."
+    return system_prompt
+
+
+# ========== Per-Report Templates ==========
+class CompiledTemplate:
+    """
+    模板只在定义时解析一次，拆成 [(文字, 字段名), ...]。
+    format() 只做字符串拼接，不会再解析填进去的报告或 LLM 输出，
+    所以内容里出现 { 或 } 也不会出错。
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self.parts = [(literal, field) for literal, field, _, _ in Formatter().parse(template)]
+        self.input_variables = [field for _, field in self.parts if field]
+
+    def format(self, **values):
+        pieces = []
+        for literal, field in self.parts:
+            pieces.append(literal)
+            if field:
+                pieces.append(str(values[field]))
+        return "".join(pieces)
+
+
+# 模块级 registry：import 时编译一次，所有 Agent 实例共用
+PROMPT_TEMPLATES = {
+    "Cardiologist": CompiledTemplate("Medical Report:\n{medical_report}"),
+    "Psychologist": CompiledTemplate("Patient Report:\n{medical_report}"),
+    "MultidisciplinaryTeam": CompiledTemplate(
+        "Cardiologist Report:\n{cardiologist_report}\n\nPsychologist Report:\n{psychologist_report}\n"
+    ),
+}
+
+
+def build_messages(system_prompt, sections):
+    """
+    组装 chat messages：固定的 system message 在前，每份报告不同的内容（工具输出、RAG、报告本身）在后。
+    sections 是 (标题, 内容) 列表，内容为空的部分会被跳过。
+    """
+    user_content = "\n\n".join(
+        f"{title}:\n{content}" if title else content
+        for title, content in sections
+        if content
+    )
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_content},
+    ]
+
+
+def prefix_fingerprint(messages):
+    """
+    对所有在最后一条 user message 之前的内容做哈希。
+    同一角色的不同报告应该得到同样的指纹，否则前缀缓存无法命中。
+    """
+    digest = hashlib.sha256()
+    for message in messages[:-1]:
+        digest.update(message["role"].encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(message["content"].encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def user_fingerprint(messages):
+    """
+    对最后一条 user message（报告、工具输出、RAG 内容等每次都不同的部分）做哈希，
+    和 prefix_fingerprint 一起唯一确定一次调用的输入。
+    """
+    return hashlib.sha256(messages[-1]["content"].encode("utf-8")).hexdigest()[:16]
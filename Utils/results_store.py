@@ -0,0 +1,263 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from Utils.prompt_layout import build_system_prompt, prefix_fingerprint, user_fingerprint
+from Utils.structured_output import schema_instruction
+
+DEFAULT_RESULTS_PATH = "results/results.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      TEXT PRIMARY KEY,
+    pipeline    TEXT NOT NULL,
+    started_at  REAL NOT NULL,
+    finished_at REAL,
+    config      TEXT
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    id                 INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id             TEXT NOT NULL REFERENCES runs(run_id),
+    report_hash        TEXT NOT NULL,
+    report_name        TEXT,
+    role               TEXT NOT NULL,
+    stage              TEXT NOT NULL,
+    model              TEXT,
+    prompt_fingerprint TEXT,
+    user_fingerprint   TEXT,
+    output             TEXT,
+    latency            REAL,
+    prompt_tokens      INTEGER,
+    completion_tokens  INTEGER,
+    reused_from        INTEGER,
+    created_at         REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outputs_report_hash ON outputs(report_hash);
+CREATE INDEX IF NOT EXISTS idx_outputs_run_id ON outputs(run_id);
+CREATE INDEX IF NOT EXISTS idx_outputs_role ON outputs(role);
+CREATE INDEX IF NOT EXISTS idx_outputs_model ON outputs(model);
+CREATE INDEX IF NOT EXISTS idx_outputs_created_at ON outputs(created_at);
+CREATE INDEX IF NOT EXISTS idx_outputs_reuse ON outputs(report_hash, role, stage, model, prompt_fingerprint);
+"""
+
+EXPORT_COLUMNS = [
+    "id", "run_id", "report_hash", "report_name", "role", "stage", "model", "prompt_fingerprint",
+    "user_fingerprint", "output", "latency", "prompt_tokens", "completion_tokens", "reused_from", "created_at",
+]
+
+
+def report_hash(medical_report):
+    return hashlib.sha256((medical_report or "").strip().encode("utf-8")).hexdigest()
+
+
+def agent_model_name(agent, structured=False):
+    """
+    与 agent.run() 记录的 call["model"] 一致：走级联路由时是 "cascade:小模型|大模型"，
+    结构化输出（run_structured）不走路由，是 agent.model 本身。
+    """
+    router = getattr(agent, "router", None)
+    model = router if router is not None and not structured else agent.model
+    return getattr(model, "model_name", None)
+
+
+# ========== Results Store ==========
+class ResultsStore:
+    """
+    每次运行的所有中间和最终输出都追加写入 SQLite，不再覆盖 final_diagnosis.txt：
+
+    - runs    ：一次 pipeline 运行（run_id、入口脚本、配置、起止时间）
+    - outputs ：每个角色的每次输出（stage = initial / revision / mdt / mdt_update ...），
+                附带报告哈希、模型、prompt 指纹、延迟和 token 数
+
+    report_hash / run_id / role / model / created_at 都有索引，
+    lookup() 可以直接找到同一份报告、同一模型和 prompt 已经算过的结果，用来跳过重复工作。
+    """
+
+    def __init__(self, path=DEFAULT_RESULTS_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_SCHEMA)
+        # 旧版本建的库没有 user_fingerprint 列；旧记录的这一列是 NULL，不会被 lookup_agent 复用
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(outputs)")}
+        if "user_fingerprint" not in columns:
+            self.conn.execute("ALTER TABLE outputs ADD COLUMN user_fingerprint TEXT")
+        self.lock = threading.Lock()
+        self._pipelines = {}
+
+    def start_run(self, pipeline, config=None):
+        run_id = uuid.uuid4().hex
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO runs (run_id, pipeline, started_at, config) VALUES (?, ?, ?, ?)",
+                (run_id, pipeline, time.time(), json.dumps(config or {}, ensure_ascii=False)),
+            )
+            self.conn.commit()
+        self._pipelines[run_id] = pipeline
+        return run_id
+
+    def finish_run(self, run_id):
+        with self.lock:
+            self.conn.execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (time.time(), run_id))
+            self.conn.commit()
+
+    def record(self, run_id, medical_report, role, output, stage="initial", report_name=None, call=None, reused_from=None):
+        """
+        medical_report 是这次运行的原始报告（MDT 和修订版也记在原始报告的哈希下）；
+        call 是 Agent.last_call / timed_invoke 返回的调用信息（model、prompt_fingerprint、user_fingerprint、latency、tokens）。
+        """
+        call = call or {}
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO outputs (run_id, report_hash, report_name, role, stage, model, prompt_fingerprint, "
+                "user_fingerprint, output, latency, prompt_tokens, completion_tokens, reused_from, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run_id, report_hash(medical_report), report_name, role, stage,
+                    call.get("model"), call.get("prompt_fingerprint"), call.get("user_fingerprint"), output,
+                    call.get("latency"), call.get("prompt_tokens"), call.get("completion_tokens"), reused_from, time.time(),
+                ),
+            )
+            self.conn.commit()
+        return cursor.lastrowid
+
+    def lookup(self, medical_report, role, stage="initial", model=None, prompt_fingerprint=None, pipeline=None, digest=None,
+               user_fingerprint=None):
+        """
+        返回同一份报告、同一角色（可选：同一模型 / prompt 指纹 / user message 指纹 / 入口脚本）最近的一条输出，没有则返回 None。
+        已经有报告哈希时可以直接传 digest，medical_report 传 None。
+        """
+        query = (
+            "SELECT outputs.* FROM outputs JOIN runs ON runs.run_id = outputs.run_id "
+            "WHERE report_hash = ? AND role = ? AND stage = ?"
+        )
+        params = [digest or report_hash(medical_report), role, stage]
+        if model is not None:
+            query += " AND model = ?"
+            params.append(model)
+        if prompt_fingerprint is not None:
+            query += " AND prompt_fingerprint = ?"
+            params.append(prompt_fingerprint)
+        if user_fingerprint is not None:
+            query += " AND user_fingerprint = ?"
+            params.append(user_fingerprint)
+        if pipeline is not None:
+            query += " AND runs.pipeline = ?"
+            params.append(pipeline)
+        query += " AND output IS NOT NULL ORDER BY created_at DESC LIMIT 1"
+        with self.lock:
+            row = self.conn.execute(query, params).fetchone()
+        return dict(row) if row else None
+
+    def lookup_agent(self, run_id, agent, medical_report, stage="initial", structured=False, digest=None, same_input=True):
+        """
+        按 agent 当前的模型和 system prompt，查同一入口脚本里这份报告（或哈希为 digest 的报告）的历史输出。
+
+        same_input=True 时还要求完整的 user message 相同：同一份报告在 RAG 版本里检索内容、工具输出可能不同，
+        MDT 的输入也取决于这次的专科报告。只想找同一份报告的历史结果时（例如近似重复报告的修订）传 False。
+        """
+        system_prompt = agent.system_prompt
+        if structured:
+            system_prompt = build_system_prompt(agent.role, output_format=schema_instruction(agent.role))
+        messages = agent.input_messages(system_prompt)
+        return self.lookup(
+            medical_report, agent.role, stage,
+            model=agent_model_name(agent, structured),
+            prompt_fingerprint=prefix_fingerprint(messages),
+            pipeline=self._pipelines.get(run_id),
+            digest=digest,
+            user_fingerprint=user_fingerprint(messages) if same_input else None,
+        )
+
+    def record_reuse(self, run_id, medical_report, role, hit, stage="initial", report_name=None):
+        # 复用的输出也记一行，latency / tokens 为 0，reused_from 指向最初真正调用 LLM 的那一行
+        return self.record(
+            run_id, medical_report, role, hit["output"], stage, report_name,
+            call={"model": hit["model"], "prompt_fingerprint": hit["prompt_fingerprint"],
+                  "user_fingerprint": hit["user_fingerprint"], "latency": 0.0, "prompt_tokens": 0, "completion_tokens": 0},
+            reused_from=hit["reused_from"] or hit["id"],
+        )
+
+    def run_agent(self, run_id, agent, medical_report, stage="initial", report_name=None, reuse=False, structured=False):
+        """
+        运行 agent 并记录输出，返回 (输出, 是否复用)。
+
+        reuse=True 时先查同一入口脚本里同一份报告、同一模型、同一 system prompt 和 user message 的历史输出，
+        命中就直接复用，不调用 LLM。
+        structured=True 时调用 run_structured()，dict 以 JSON 文本保存。
+        """
+        if reuse:
+            hit = self.lookup_agent(run_id, agent, medical_report, stage, structured)
+            if hit is not None:
+                print(f"{agent.role}: reusing stored output #{hit['id']} for identical report")
+                self.record_reuse(run_id, medical_report, agent.role, hit, stage, report_name)
+                return (json.loads(hit["output"]) if structured else hit["output"]), True
+
+        output = agent.run_structured() if structured else agent.run()
+        if output is not None:
+            text = json.dumps(output, ensure_ascii=False) if structured else output
+            self.record(run_id, medical_report, agent.role, text, stage, report_name, call=agent.last_call)
+        return output, False
+
+    def outputs_for_run(self, run_id):
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM outputs WHERE run_id = ? ORDER BY id", (run_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def export(self, path, run_id=None, since=None):
+        """
+        批量导出到 .jsonl 或 .csv（按扩展名），逐行流式写出，不把整张表读进内存。
+        """
+        query = "SELECT * FROM outputs WHERE 1 = 1"
+        params = []
+        if run_id is not None:
+            query += " AND run_id = ?"
+            params.append(run_id)
+        if since is not None:
+            query += " AND created_at >= ?"
+            params.append(since)
+        query += " ORDER BY id"
+
+        n = 0
+        with self.lock, open(path, "w", newline="") as f:
+            cursor = self.conn.execute(query, params)
+            if path.endswith(".csv"):
+                writer = csv.DictWriter(f, fieldnames=EXPORT_COLUMNS)
+                writer.writeheader()
+                for row in cursor:
+                    writer.writerow(dict(row))
+                    n += 1
+            else:
+                for row in cursor:
+                    f.write(json.dumps(dict(row), ensure_ascii=False) + "\n")
+                    n += 1
+        return n
+
+
+# -------------------------
+# CLI: python -m Utils.results_store export out.jsonl --run-id <id>
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default=DEFAULT_RESULTS_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_parser = sub.add_parser("export")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--run-id")
+    sub.add_parser("runs")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+    if args.command == "export":
+        print(f"Exported {store.export(args.path, run_id=args.run_id)} outputs to {args.path}")
+    else:
+        for row in store.conn.execute("SELECT * FROM runs ORDER BY started_at DESC"):
+            print(dict(row))
@@ -0,0 +1,231 @@
+import heapq
+import itertools
+import re
+import threading
+import time
+
+from RAG_version.tools import analyze_lab_values, rule_flags
+
+# 规则引擎异常项的紧急程度权重（按出现的异常种类计，同一异常出现多次只算一次）
+# 心理风险是关键词匹配，很常见，三项加起来也只有 1.5；心动过速 + 高血压这类组合才到 urgent
+URGENCY_WEIGHTS = (
+    ("Low blood pressure", 3.0),
+    ("Tachycardia", 2.0),
+    ("Bradycardia", 2.0),
+    ("High blood pressure", 2.0),
+    ("High cholesterol", 1.0),
+    ("Possible depression", 0.5),
+    ("Possible anxiety", 0.5),
+    ("Possible stress", 0.5),
+)
+
+# 危急值：单项就足够严重，额外加分（例如心率 150 单独就能到 urgent）
+CRITICAL_WEIGHT = 2.0
+CRITICAL_HEART_RATE = (40, 130)
+CRITICAL_SYSTOLIC = (80, 180)
+CRITICAL_DIASTOLIC = 120
+
+_DETECTED_HR = re.compile(r"Detected heart rate: (\d+) bpm")
+_DETECTED_BP = re.compile(r"Detected blood pressure: (\d+)/(\d+)")
+
+# (优先级, 最低分数, 目标完成时间/秒)，按紧急程度从高到低
+PRIORITY_CLASSES = (
+    ("urgent", 4.0, 60.0),
+    ("high", 2.0, 300.0),
+    ("routine", 0.0, 1800.0),
+)
+
+_DONE = object()
+
+
+# ========== Urgency Scoring ==========
+def critical_vitals(lab_output):
+    """
+    从 analyze_lab_values 的输出里找危急值，返回描述列表。
+    """
+    critical = []
+    for hr in map(int, _DETECTED_HR.findall(lab_output)):
+        if not CRITICAL_HEART_RATE[0] < hr < CRITICAL_HEART_RATE[1]:
+            critical.append(f"Critical heart rate: {hr} bpm")
+    for systolic, diastolic in _DETECTED_BP.findall(lab_output):
+        systolic, diastolic = int(systolic), int(diastolic)
+        if not CRITICAL_SYSTOLIC[0] < systolic < CRITICAL_SYSTOLIC[1] or diastolic >= CRITICAL_DIASTOLIC:
+            critical.append(f"Critical blood pressure: {systolic}/{diastolic}")
+    return critical
+
+
+def urgency(medical_report):
+    """
+    不调用 LLM，用心内科和心理科的规则引擎（RAG_version/tools.py）给报告打分，危急值额外加分。
+    返回 (优先级, 分数, 异常项列表)。
+    """
+    flags = []
+    for role in ("Cardiologist", "Psychologist"):
+        for flag in rule_flags(medical_report, role):
+            if flag not in flags:
+                flags.append(flag)
+    score = 0.0
+    for name, weight in URGENCY_WEIGHTS:
+        if any(name in flag for flag in flags):
+            score += weight
+    for flag in dict.fromkeys(critical_vitals(analyze_lab_values(medical_report))):
+        flags.append(flag)
+        score += CRITICAL_WEIGHT
+    for priority, min_score, _ in PRIORITY_CLASSES:
+        if score >= min_score:
+            return priority, score, flags
+    return PRIORITY_CLASSES[-1][0], score, flags
+
+
+def percentile(values, q):
+    """
+    最近秩百分位数，q 取 0-100；values 为空时返回 None。
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+# ========== Deadline Scheduler ==========
+class PriorityScheduler:
+    """
+    有界的截止时间优先队列，替代 process_stream 里的 queue.Queue。
+
+    - put(item, priority)  报告进队时按 到达时间 + 该优先级的目标完成时间 定出截止时间；
+                           队列满（maxsize）时阻塞，保留 process_stream 的背压
+    - get(reserved)        普通 worker 取截止时间最早的报告（EDF），等得太久的 routine 报告最终也会排到前面；
+                           reserved=True 的 worker 是给 urgent 报告预留的，只取 urgent
+    - done(entry, ok)      记录从进队到出结果的时间，按优先级统计 p50 / p99 和超出截止时间的数量
+    """
+
+    def __init__(self, maxsize, classes=PRIORITY_CLASSES):
+        self.maxsize = maxsize
+        self.deadlines = {name: deadline for name, _, deadline in classes}
+        self.heaps = {name: [] for name, _, _ in classes}
+        self.size = 0
+        self.closed = False
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.latencies = {name: [] for name, _, _ in classes}
+        self.missed = {name: 0 for name, _, _ in classes}
+        self.failed = {name: 0 for name, _, _ in classes}
+
+    def put(self, item, priority):
+        # 到达时间在等队列空位之前取：背压等待的时间也算进 time-to-result 和截止时间
+        arrived = time.perf_counter()
+        with self.cond:
+            while self.size >= self.maxsize:
+                self.cond.wait()
+            entry = (arrived + self.deadlines[priority], next(self.seq), arrived, priority, item)
+            heapq.heappush(self.heaps[priority], entry)
+            self.size += 1
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def _pop(self, reserved):
+        if reserved:
+            heap = self.heaps[PRIORITY_CLASSES[0][0]]
+            return heapq.heappop(heap) if heap else None
+        heads = [heap for heap in self.heaps.values() if heap]
+        if not heads:
+            return None
+        return heapq.heappop(min(heads, key=lambda heap: heap[0]))
+
+    def get(self, reserved=False):
+        """
+        返回 (截止时间, 序号, 到达时间, 优先级, item)；队列已关闭且（对该 worker 而言）没有可取的报告时返回 _DONE。
+        """
+        with self.cond:
+            while True:
+                entry = self._pop(reserved)
+                if entry is not None:
+                    self.size -= 1
+                    self.cond.notify_all()
+                    return entry
+                if self.closed:
+                    return _DONE
+                self.cond.wait()
+
+    def done(self, entry, ok=True):
+        deadline, _, arrived, priority, _ = entry
+        finished = time.perf_counter()
+        with self.cond:
+            self.latencies[priority].append(finished - arrived)
+            self.missed[priority] += finished > deadline
+            self.failed[priority] += not ok
+
+    def stats(self):
+        with self.cond:
+            return {
+                priority: {
+                    "count": len(latencies),
+                    "failed": self.failed[priority],
+                    "p50": percentile(latencies, 50),
+                    "p99": percentile(latencies, 99),
+                    "max": max(latencies) if latencies else None,
+                    "deadline": self.deadlines[priority],
+                    "missed_deadline": self.missed[priority],
+                }
+                for priority, latencies in self.latencies.items()
+            }
+
+
+def process_prioritized(source, handler, workers=4, queue_size=None, reserved=1, classify=urgency):
+    """
+    与 process_stream 相同的生产者 / worker 结构，但队列换成 PriorityScheduler：
+    生产者读入报告后先用 classify（规则引擎，不调用 LLM）打分再进队，
+    workers 个线程里有 reserved 个只处理 urgent 报告，积压时紧急报告不会等不到空闲的 worker。
+
+    队列越长，能提前看到并插队的报告越多；内存里最多 queue_size + workers 份报告。
+    返回 processed / failed / elapsed，以及每个优先级的 time-to-result 统计（classes）。
+    """
+    if not 0 <= reserved < workers:
+        raise ValueError(f"reserved workers ({reserved}) must be less than workers ({workers})")
+    scheduler = PriorityScheduler(queue_size or 2 * workers)
+    stats = {"processed": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def produce():
+        try:
+            for item in source:
+                priority, score, flags = classify(item[1])
+                if priority == PRIORITY_CLASSES[0][0]:
+                    print(f"[priority] {item[0]} is {priority} (score {score:g}): {'; '.join(flags)}")
+                scheduler.put(item, priority)
+        except Exception as e:
+            print(f"Ingestion stopped: {e}")
+        finally:
+            scheduler.close()
+
+    def consume(reserved_slot):
+        while True:
+            entry = scheduler.get(reserved_slot)
+            if entry is _DONE:
+                return
+            report_name, text = entry[-1]
+            try:
+                handler(report_name, text)
+                key = "processed"
+            except Exception as e:
+                print(f"Failed to process {report_name}: {e}")
+                key = "failed"
+            scheduler.done(entry, ok=key == "processed")
+            with lock:
+                stats[key] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=produce, daemon=True)]
+    threads += [threading.Thread(target=consume, args=(i < reserved,), daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats["elapsed"] = time.perf_counter() - start
+    stats["classes"] = scheduler.stats()
+    return stats
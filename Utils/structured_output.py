@@ -0,0 +1,264 @@
+import json
+import math
+import os
+import threading
+
+# ========== Output Schemas ==========
+# 每个角色输出一个 JSON 对象，下游直接读字段，不需要再让 LLM 二次抽取
+_SPECIALIST_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "findings": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "condition": {"type": "string"},
+                    "evidence": {"type": "string"},
+                },
+                "required": ["condition", "evidence"],
+            },
+        },
+        "next_steps": {"type": "array", "items": {"type": "string"}},
+        "risk_level": {"type": "string", "enum": ["low", "moderate", "high"]},
+    },
+    "required": ["findings", "next_steps", "risk_level"],
+}
+
+ROLE_SCHEMAS = {
+    "Cardiologist": _SPECIALIST_SCHEMA,
+    "Psychologist": _SPECIALIST_SCHEMA,
+    "MultidisciplinaryTeam": {
+        "type": "object",
+        "properties": {
+            "diagnoses": {
+                "type": "array",
+                "minItems": 3,
+                "maxItems": 3,
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "diagnosis": {"type": "string"},
+                        "rationale": {"type": "string"},
+                        "cause_category": {"type": "string", "enum": ["cardiac", "psychological", "mixed"]},
+                    },
+                    "required": ["diagnosis", "rationale", "cause_category"],
+                },
+            },
+        },
+        "required": ["diagnoses"],
+    },
+}
+
+
+def schema_instruction(role):
+    """
+    追加到 system prompt 末尾的输出格式要求（静态文本，不影响前缀缓存）。
+    """
+    return (
+        "Respond with a single JSON object that matches this JSON schema, "
+        "with no text before or after it. Keep every string short.\n"
+        + json.dumps(ROLE_SCHEMAS[role], ensure_ascii=False)
+    )
+
+
+# -------------------------
+# Parsing / validation
+# -------------------------
+class JsonObjectScanner:
+    """
+    增量扫描流式输出，判断第一个顶层 JSON 对象是否已经闭合。
+    闭合之后 schema 已经完整，后面的 token 都可以不要了（early stop）。
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escape = False
+        self.end = None  # 顶层对象结束位置（不含）
+        self._pos = 0
+
+    def feed(self, chunk):
+        for ch in chunk:
+            self._pos += 1
+            if self.end is not None:
+                break
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"' and self.started:
+                self.in_string = True
+            elif ch == "{":
+                self.started = True
+                self.depth += 1
+            elif ch == "}" and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = self._pos
+        return self.end is not None
+
+
+def extract_json(text):
+    """
+    取出文本中第一个完整的 JSON 对象（兼容模型在前后加了 ```json 之类的包装）。
+    """
+    start = text.find("{")
+    if start == -1:
+        raise ValueError("No JSON object found in model output")
+    scanner = JsonObjectScanner()
+    if not scanner.feed(text[start:]):
+        raise ValueError("Model output ended before the JSON object was complete")
+    return json.loads(text[start:start + scanner.end])
+
+
+_JSON_TYPES = {"object": dict, "array": list, "string": str}
+
+
+def validate(data, schema):
+    """
+    只覆盖上面 schema 用到的关键字：type / properties / required / items / enum / minItems / maxItems。
+    """
+    expected = _JSON_TYPES[schema["type"]]
+    if not isinstance(data, expected):
+        raise ValueError(f"Expected {schema['type']}, got {type(data).__name__}")
+    if "enum" in schema and data not in schema["enum"]:
+        raise ValueError(f"{data!r} is not one of {schema['enum']}")
+    if isinstance(data, dict):
+        for key in schema.get("required", []):
+            if key not in data:
+                raise ValueError(f"Missing required field '{key}'")
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in data:
+                validate(data[key], sub_schema)
+    if isinstance(data, list):
+        if len(data) < schema.get("minItems", 0):
+            raise ValueError(f"Expected at least {schema['minItems']} items, got {len(data)}")
+        if len(data) > schema.get("maxItems", len(data)):
+            raise ValueError(f"Expected at most {schema['maxItems']} items, got {len(data)}")
+        for item in data:
+            validate(item, schema["items"])
+    return data
+
+
+def estimate_tokens(text):
+    """
+    粗略估计 token 数：中日韩字符每个约 1 token，其余约 4 个字符 1 token。
+    """
+    cjk = sum(1 for ch in text if "　" <= ch <= "鿿")
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+# ========== Adaptive Token Budgets ==========
+DEFAULT_ROLE_MAX_TOKENS = {
+    "Cardiologist": 500,
+    "Psychologist": 500,
+    "MultidisciplinaryTeam": 700,
+}
+DEFAULT_BUDGET_PATH = "results/token_budgets.json"
+
+
+class TokenBudgets:
+    """
+    按角色记录最近的输出长度，用 p95 * headroom 作为下一次的 max_tokens。
+    观测数据保存在 JSON 文件里，跨进程累积。
+    """
+
+    def __init__(self, path=DEFAULT_BUDGET_PATH, headroom=1.25, window=200, min_tokens=128, max_tokens=800):
+        self.path = path
+        self.headroom = headroom
+        self.window = window
+        self.min_tokens = min_tokens
+        self.max_tokens_cap = max_tokens
+        self.lock = threading.Lock()
+        self.observed = {}
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                self.observed = json.load(f)
+
+    def max_tokens(self, role):
+        lengths = sorted(self.observed.get(role, []))
+        if len(lengths) < 5:
+            return DEFAULT_ROLE_MAX_TOKENS.get(role, self.max_tokens_cap)
+        p95 = lengths[min(len(lengths) - 1, int(0.95 * len(lengths)))]
+        return max(self.min_tokens, min(self.max_tokens_cap, math.ceil(p95 * self.headroom)))
+
+    def observe(self, role, n_tokens):
+        with self.lock:
+            lengths = self.observed.setdefault(role, [])
+            lengths.append(n_tokens)
+            del lengths[:-self.window]
+            if self.path:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "w") as f:
+                    json.dump(self.observed, f)
+
+
+token_budgets = TokenBudgets()
+
+
+# -------------------------
+# Structured call
+# -------------------------
+def _stream_json(backend, messages, max_tokens, schema):
+    """
+    流式读取输出，JSON 对象一闭合就停止读取（关闭流会让服务端中止生成）。
+    返回 (文本, JSON 对象是否已闭合)；没闭合说明输出被 max_tokens 截断了。
+    """
+    text = ""
+    scanner = JsonObjectScanner()
+    stream = backend.stream(messages, max_tokens=max_tokens, json_schema=schema)
+    try:
+        for chunk in stream:
+            text += chunk
+            if scanner.feed(chunk):
+                break
+    finally:
+        stream.close()
+    return text, scanner.end is not None
+
+
+def invoke_structured(backend, messages, role, budgets=None):
+    """
+    用角色自己的 token 预算调用模型，JSON 对象一闭合就停止读取，然后解析并按 schema 校验。
+    学到的预算不够、输出被截断时，用 max_tokens 上限重试一次。
+    只有完整的输出才计入输出长度统计，截断的长度只是预算本身，会让预算越学越小。
+    """
+    budgets = budgets or token_budgets
+    schema = ROLE_SCHEMAS[role]
+    max_tokens = budgets.max_tokens(role)
+
+    if hasattr(backend, "stream"):
+        text, complete = _stream_json(backend, messages, max_tokens, schema)
+        if not complete and max_tokens < budgets.max_tokens_cap:
+            print(f"{role}: output truncated at {max_tokens} tokens, retrying with {budgets.max_tokens_cap}")
+            text, complete = _stream_json(backend, messages, budgets.max_tokens_cap, schema)
+    else:
+        text = backend.invoke(messages)
+        complete = JsonObjectScanner().feed(text[max(text.find("{"), 0):])
+
+    if complete:
+        budgets.observe(role, estimate_tokens(text))
+    return validate(extract_json(text), schema)
+
+
+# -------------------------
+# Rendering
+# -------------------------
+def render_specialist(data):
+    lines = [f"Risk level: {data['risk_level']}", "Findings:"]
+    lines += [f"- {f['condition']}: {f['evidence']}" for f in data["findings"]]
+    lines.append("Next steps:")
+    lines += [f"- {step}" for step in data["next_steps"]]
+    return "\n".join(lines)
+
+
+def render_mdt(data):
+    lines = []
+    for i, d in enumerate(data["diagnoses"], 1):
+        lines.append(f"- **Diagnosis {i}: {d['diagnosis']}** ({d['cause_category']})\n  {d['rationale']}")
+    return "\n".join(lines)
@@ -0,0 +1,267 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# 批量处理多份医疗报告：同一角色的 prompt 通过 MicroBatcher 合并成批量请求
+# python batch_main.py "Medical Reports/medical_report_chinese.txt" "Medical Reports/medical_report_english.txt"
+# python batch_main.py reports.jsonl            # 或目录（--watch 持续监听）、"-"（stdin 上的 JSONL）
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import argparse
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from Utils.myagent import Cardiologist, Psychologist, MultidisciplinaryTeam
+from Utils.batching import shared_batcher, close_shared_batchers
+from Utils.structured_output import render_specialist, render_mdt
+from Utils.cascade import CascadeRouter, small_model_name
+from Utils.results_store import DEFAULT_RESULTS_PATH, ResultsStore, report_hash
+from Utils.ingestion import iter_sources, process_stream
+from Utils.dedup import DEFAULT_DEDUP_INDEX, DedupIndex, revise_for_near_duplicate, same_clinical_content
+from Utils.budget import BudgetExceeded, RunBudget
+from Utils.language import Translator, output_language
+from Utils.scheduler import process_prioritized
+from RAG_version.tools import rule_flags
+
+
+# 加载 hf.env 文件
+load_dotenv("hf.env", override=True)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("reports", nargs="+", help="report files, directories, .jsonl feeds, or '-' for JSONL on stdin")
+parser.add_argument("--watch", action="store_true", help="keep polling report directories for new files")
+parser.add_argument("--queue-size", type=int, default=None, help="reports buffered ahead of the LLM stage (default: 2 x workers)")
+parser.add_argument("--output-dir", default="results/batch")
+parser.add_argument("--max-batch-size", type=int, default=8)
+parser.add_argument("--max-wait", type=float, default=0.05, help="seconds to wait for more prompts before sending a batch")
+parser.add_argument("--max-inflight-batches", type=int, default=4, help="batches per role sent concurrently while the next one is collected")
+parser.add_argument("--workers", type=int, default=16)
+parser.add_argument("--structured", action="store_true", help="JSON outputs with per-role token budgets")
+parser.add_argument("--cascade", action="store_true", help="run specialists on a small model first, escalate on low confidence")
+parser.add_argument("--results-db", default=DEFAULT_RESULTS_PATH, help="SQLite file every output is recorded in")
+parser.add_argument("--reuse", action="store_true", help="reuse stored outputs for reports that were already processed with the same model and prompt")
+parser.add_argument("--dedup", action="store_true", help="reuse or lightly revise MDT results of near-duplicate reports")
+parser.add_argument("--dedup-index", default=DEFAULT_DEDUP_INDEX, help="SQLite file for the MinHash index (':memory:' for this run only)")
+parser.add_argument("--dedup-threshold", type=float, default=0.8, help="similarity above which the prior MDT is revised instead of recomputed")
+parser.add_argument("--dedup-reuse-threshold", type=float, default=0.95, help="similarity above which the prior MDT is reused as is, if only dates, times and IDs differ")
+parser.add_argument("--max-tokens-per-report", type=int, default=None, help="token budget per report (prompt + completion, all calls)")
+parser.add_argument("--max-calls-per-report", type=int, default=None, help="LLM call budget per report, failed calls included")
+parser.add_argument("--max-seconds-per-report", type=float, default=None, help="cumulative LLM latency budget per report")
+parser.add_argument("--priority", action="store_true", help="dispatch reports by rule-engine urgency and deadline instead of first come, first served")
+parser.add_argument("--reserved-workers", type=int, default=None, help="workers kept free for urgent reports (default: workers / 4)")
+parser.add_argument("--output-language", default=os.environ.get("OUTPUT_LANGUAGE", "auto"), help="language of the final text: auto (follow each report), none, zh or en")
+args = parser.parse_args()
+if args.structured and args.cascade:
+    # 级联要求小模型在输出末尾自报置信度，和 JSON schema 输出冲突
+    parser.error("--cascade cannot be combined with --structured")
+
+SPECIALISTS = {"Cardiologist": Cardiologist, "Psychologist": Psychologist}
+# 级联的小模型和大模型也走共用的 batcher：所有专科角色的小模型调用合并成一批，大模型调用与该角色的 batcher 合并
+routers = {
+    role: CascadeRouter.for_role(
+        role,
+        small=shared_batcher("Small", args.max_batch_size, args.max_wait, args.max_inflight_batches, model_name=small_model_name()),
+        large=shared_batcher(role, args.max_batch_size, args.max_wait, args.max_inflight_batches),
+    )
+    for role in SPECIALISTS
+} if args.cascade else {}
+
+store = ResultsStore(args.results_db)
+run_id = store.start_run("batch_main", {"reports": args.reports, "structured": args.structured, "cascade": args.cascade, "output_language": args.output_language})
+
+dedup = DedupIndex(args.dedup_index, threshold=args.dedup_threshold) if args.dedup else None
+dedup_outcomes = {"reused": 0, "revised": 0}
+dedup_lock = threading.Lock()
+
+# agent 都用工作语言，最终的 MDT 文本每份报告只翻译一次；所有 worker 共用一个带缓存的 Translator
+translator = Translator()
+
+budget_totals = {"tokens": 0, "calls": 0, "degraded": 0, "exceeded": 0}
+budget_lock = threading.Lock()
+
+# 每份报告的专科 agent 并发跑；同时在处理的报告最多 args.workers 份
+specialist_pool = ThreadPoolExecutor(max_workers=args.workers * len(SPECIALISTS))
+
+
+def run_specialist(report_name, medical_report, role, budget):
+    agent = SPECIALISTS[role](medical_report)
+    agent.budget = budget
+    # 同一角色的所有报告共用一个 batcher，线程池里同时等待的 prompt 会被合并
+    agent.model = shared_batcher(role, args.max_batch_size, args.max_wait, args.max_inflight_batches)
+    if args.cascade:
+        agent.router = routers[role]
+        agent.rule_flags = rule_flags(medical_report, role)
+    return store.run_agent(
+        run_id, agent, medical_report, report_name=report_name, reuse=args.reuse, structured=args.structured
+    )
+
+
+def run_mdt(report_name, medical_report, responses, budget, reuse=False):
+    if args.structured:
+        # 结构化的专科结果先渲染成简短文本再交给 MDT
+        responses = {role: render_specialist(data) if data else "" for role, data in responses.items()}
+    agent = MultidisciplinaryTeam(
+        cardiologist_report=responses["Cardiologist"],
+        psychologist_report=responses["Psychologist"]
+    )
+    agent.budget = budget
+    agent.model = shared_batcher("MultidisciplinaryTeam", args.max_batch_size, args.max_wait, args.max_inflight_batches)
+    response, _ = store.run_agent(
+        run_id, agent, medical_report, stage="mdt", report_name=report_name, reuse=reuse, structured=args.structured
+    )
+    return response
+
+
+def reuse_near_duplicate(report_name, medical_report, signature, budget):
+    """
+    在去重索引里找相似的已分析报告：相似度 >= --dedup-reuse-threshold 且只有日期、时间、编号不同
+    （same_clinical_content）时直接复用它的 MDT 诊断；其余相似度 >= --dedup-threshold 的报告
+    只按两份报告的 diff 轻量修订（结构化输出不做修订）。
+    没有可用的历史结果时返回 None，照常跑完整流程。
+    """
+    match = dedup.query(medical_report, signature)
+    if match is None:
+        return None
+    key, similarity = match
+    agent = MultidisciplinaryTeam(cardiologist_report="", psychologist_report="")
+    agent.model = shared_batcher("MultidisciplinaryTeam", args.max_batch_size, args.max_wait, args.max_inflight_batches)
+    hit = store.lookup_agent(run_id, agent, None, stage="mdt", structured=args.structured, digest=key, same_input=False)
+    if hit is None:
+        return None
+
+    previous_report = dedup.report(key)
+    if similarity >= args.dedup_reuse_threshold and same_clinical_content(previous_report, medical_report):
+        print(f"{report_name}: near-duplicate (similarity {similarity:.2f}), reusing MDT output #{hit['id']}")
+        store.record_reuse(run_id, medical_report, agent.role, hit, stage="mdt", report_name=report_name)
+        outcome, final_diagnosis = "reused", json.loads(hit["output"]) if args.structured else hit["output"]
+    elif args.structured:
+        return None
+    else:
+        print(f"{report_name}: near-duplicate (similarity {similarity:.2f}), revising MDT output #{hit['id']}")
+        try:
+            final_diagnosis, call = revise_for_near_duplicate(
+                hit["output"], previous_report, medical_report, agent.model, budget
+            )
+        except BudgetExceeded as e:
+            print(f"{report_name}: {e}")
+            return None
+        store.record(
+            run_id, medical_report, agent.role, final_diagnosis, stage="mdt_near_duplicate",
+            report_name=report_name, call=call, reused_from=hit["reused_from"] or hit["id"],
+        )
+        outcome = "revised"
+    with dedup_lock:
+        dedup_outcomes[outcome] += 1
+    return final_diagnosis
+
+
+def run_pipeline(report_name, medical_report, budget):
+    # Step 1: specialists
+    futures = {
+        role: specialist_pool.submit(run_specialist, report_name, medical_report, role, budget) for role in SPECIALISTS
+    }
+    responses, reused = {}, {}
+    for role, future in futures.items():
+        responses[role], reused[role] = future.result()
+
+    # Step 2: MDT（两份专科报告都是复用的，MDT 的输入也完全相同，可以一起复用）
+    return run_mdt(report_name, medical_report, responses, budget, args.reuse and all(reused.values()))
+
+
+def write_diagnosis(report_name, medical_report, final_diagnosis, budget):
+    # JSONL 里的 id 可能带路径分隔符
+    file_name = re.sub(r"[^\w.-]+", "_", report_name)
+    budget.write_report(os.path.join(args.output_dir, f"{file_name}_budget.json"))
+    if args.structured and final_diagnosis:
+        json_output_path = os.path.join(args.output_dir, f"{file_name}_final_diagnosis.json")
+        with open(json_output_path, "w") as json_file:
+            json.dump(final_diagnosis, json_file, ensure_ascii=False, indent=2)
+        final_diagnosis = render_mdt(final_diagnosis)
+    # JSON 结果保持工作语言，只翻译给人看的文本
+    translated, call = translator.translate(final_diagnosis, output_language(medical_report, args.output_language), budget)
+    if translated != final_diagnosis:
+        store.record(run_id, medical_report, "Translator", translated, stage="translation", report_name=report_name, call=call)
+        final_diagnosis = translated
+    txt_output_path = os.path.join(args.output_dir, f"{file_name}_final_diagnosis.txt")
+    with open(txt_output_path, "w") as txt_file:
+        txt_file.write("### Final Diagnosis:\n\n" + (final_diagnosis or ""))
+    print(f"Final diagnosis has been saved to {txt_output_path}")
+
+
+def process_report(report_name, medical_report):
+    # 每份报告单独的预算，专科、MDT 和近似重复修订共用
+    budget = RunBudget(args.max_tokens_per_report, args.max_calls_per_report, args.max_seconds_per_report)
+    final_diagnosis = None
+    if dedup is not None:
+        signature = dedup.signature(medical_report)
+        final_diagnosis = reuse_near_duplicate(report_name, medical_report, signature, budget)
+    if final_diagnosis is None:
+        final_diagnosis = run_pipeline(report_name, medical_report, budget)
+        # 只把完整跑过的报告加入索引，近似重复的报告都以原始分析为基础
+        if dedup is not None and final_diagnosis:
+            dedup.add(report_hash(medical_report), medical_report, signature)
+    write_diagnosis(report_name, medical_report, final_diagnosis, budget)
+
+    report = budget.report()
+    with budget_lock:
+        budget_totals["tokens"] += report["used"]["tokens"]
+        budget_totals["calls"] += report["used"]["calls"]
+        budget_totals["degraded"] += bool(report["degradations"])
+        budget_totals["exceeded"] += any(event["event"] == "exceeded" for event in report["events"])
+
+
+# -------------------------
+# 报告以流的方式读入有界队列：LLM 阶段饱和时读取自动放慢，内存占用与 feed 长度无关
+# -------------------------
+os.makedirs(args.output_dir, exist_ok=True)
+if args.priority:
+    # 进队前先用规则引擎给报告分级，urgent 报告优先，并有预留的 worker
+    stats = process_prioritized(
+        iter_sources(args.reports, watch=args.watch),
+        process_report,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        reserved=args.reserved_workers if args.reserved_workers is not None else min(max(1, args.workers // 4), args.workers - 1),
+    )
+else:
+    stats = process_stream(
+        iter_sources(args.reports, watch=args.watch),
+        process_report,
+        workers=args.workers,
+        queue_size=args.queue_size,
+    )
+specialist_pool.shutdown()
+print(
+    f"{stats['processed']} reports processed ({stats['failed']} failed) in {stats['elapsed']:.1f}s"
+    f" ({stats['processed'] / max(stats['elapsed'], 1e-9):.2f} reports/s)"
+)
+if args.priority:
+    for priority, latency in stats["classes"].items():
+        if latency["count"]:
+            print(
+                f"{priority}: {latency['count']} reports, time-to-result p50 {latency['p50']:.1f}s / p99 {latency['p99']:.1f}s, "
+                f"{latency['missed_deadline']} over the {latency['deadline']:.0f}s deadline"
+            )
+    with open(os.path.join(args.output_dir, "priority_latency.json"), "w") as f:
+        json.dump(stats["classes"], f, indent=2)
+print(
+    f"Budgets: {budget_totals['tokens']} tokens in {budget_totals['calls']} calls, "
+    f"{budget_totals['degraded']} reports degraded, {budget_totals['exceeded']} hit the hard limit"
+)
+if dedup is not None:
+    dedup_stats = dedup.stats()
+    print(
+        f"Dedup: {dedup_stats['hits']}/{dedup_stats['queries']} near-duplicates (hit rate {dedup_stats['hit_rate']:.1%}), "
+        f"{dedup_outcomes['reused']} reused, {dedup_outcomes['revised']} revised, "
+        f"{dedup_stats['queries_per_second']:.0f} lookups/s, {dedup_stats['size']} reports indexed"
+    )
+
+if translator.hits or translator.misses:
+    print(f"Translation: {translator.misses} translated, {translator.hits} from cache")
+
+for role in list(SPECIALISTS) + ["MultidisciplinaryTeam"] + (["Small"] if args.cascade else []):
+    sizes = shared_batcher(role).batch_sizes
+    if sizes:
+        print(f"{role}: {sum(sizes)} prompts in {len(sizes)} batches")
+close_shared_batchers()
+store.finish_run(run_id)
+print(f"Run {run_id} recorded in {store.path}")
@@ -0,0 +1,121 @@
+"""
+Time-to-first-token benchmark for the prompt layout.
+
+Compares two layouts against a local OpenAI-compatible server with prefix caching enabled
+(e.g. `vllm serve <model> --enable-prefix-caching` or llama.cpp `llama-server`, which caches prompts by default):
+
+- system_prefix : static role instructions in the system message, per-report content last (Utils/prompt_layout.py)
+- variable_first: the old RAG layout, tool output + RAG context prepended ahead of the instructions
+
+Usage:
+    python benchmarks/bench_prefix_cache.py --base-url http://localhost:8000/v1 --model <model> --reports 20
+    python benchmarks/bench_prefix_cache.py --dry-run   # only check prefix stability, no server needed
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Utils.prompt_layout import build_messages, build_system_prompt, prefix_fingerprint
+
+
+def load_reports(n):
+    base_dir = "Medical Reports"
+    texts = []
+    for name in sorted(os.listdir(base_dir)):
+        with open(os.path.join(base_dir, name), "r") as file:
+            texts.append(file.read())
+    # 生成 n 份互不相同的报告（只改病历号），模拟一批不同的输入
+    return [f"病历号：{i:06d}\n{texts[i % len(texts)]}" for i in range(n)]
+
+
+def system_prefix_layout(role, report, tool_output, rag_context):
+    return build_messages(build_system_prompt(role), [
+        ("### Tool-assisted analysis", tool_output),
+        ("### Reference from external medical library", rag_context),
+        ("Medical Report", report),
+    ])
+
+
+def variable_first_layout(role, report, tool_output, rag_context):
+    prompt = f"{build_system_prompt(role)}\n\nMedical Report:\n{report}"
+    prompt = f"### Reference from external medical library:\n{rag_context}\n\n{prompt}"
+    prompt = f"### Tool-assisted analysis:\n{tool_output}\n\n{prompt}"
+    return [{"role": "user", "content": prompt}]
+
+
+def shared_prefix_chars(messages_a, messages_b):
+    a = "".join(m["content"] for m in messages_a)
+    b = "".join(m["content"] for m in messages_b)
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def time_to_first_token(client, model, messages):
+    start = time.perf_counter()
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        max_tokens=8,
+        temperature=0,
+        stream=True,
+    )
+    ttft = None
+    for chunk in stream:
+        if ttft is None and chunk.choices and chunk.choices[0].delta.content:
+            ttft = time.perf_counter() - start
+    return ttft if ttft is not None else time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8000/v1")
+    parser.add_argument("--api-key", default="EMPTY")
+    parser.add_argument("--model", default="openai/gpt-oss-20b")
+    parser.add_argument("--role", default="Cardiologist")
+    parser.add_argument("--reports", type=int, default=20)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    reports = load_reports(args.reports)
+    layouts = {
+        "system_prefix": system_prefix_layout,
+        "variable_first": variable_first_layout,
+    }
+    prompts = {
+        name: [
+            build(args.role, report, f"Detected heart rate: {100 + i} bpm", f"reference passage {i}")
+            for i, report in enumerate(reports)
+        ]
+        for name, build in layouts.items()
+    }
+
+    fingerprints = {prefix_fingerprint(messages) for messages in prompts["system_prefix"]}
+    print(f"system_prefix fingerprints across {len(reports)} reports: {sorted(fingerprints)}")
+    for name, messages_list in prompts.items():
+        shared = min(shared_prefix_chars(messages_list[0], m) for m in messages_list[1:])
+        print(f"{name:15s} shared leading chars: {shared}")
+
+    if args.dry_run:
+        return
+
+    from openai import OpenAI
+    client = OpenAI(base_url=args.base_url, api_key=args.api_key)
+
+    for name, messages_list in prompts.items():
+        # 第一条请求用来预热前缀缓存，不计入统计
+        time_to_first_token(client, args.model, messages_list[0])
+        ttfts = [time_to_first_token(client, args.model, messages) for messages in messages_list[1:]]
+        ttfts.sort()
+        p90 = ttfts[int(0.9 * (len(ttfts) - 1))]
+        print(f"{name:15s} TTFT median {statistics.median(ttfts) * 1000:8.1f} ms   p90 {p90 * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
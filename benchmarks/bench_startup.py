@@ -0,0 +1,75 @@
+"""
+Process startup benchmark: how long a fresh interpreter takes to import each entry module.
+
+Every measurement runs in a new subprocess (so nothing is cached in sys.modules) and the
+slowest imports are reported from `python -X importtime`.
+
+Usage:
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    ("Utils.myagent", ROOT),
+    ("Utils.agent_humanfeedback", ROOT),
+    ("batch_main", None),  # 只测 import 开销，见下面的 --help
+    ("agent", os.path.join(ROOT, "RAG_version")),
+]
+
+
+def time_import(module, cwd, runs):
+    if module == "batch_main":
+        cmd = [sys.executable, os.path.join(ROOT, "batch_main.py"), "--help"]
+        cwd = ROOT
+    else:
+        cmd = [sys.executable, "-c", f"import {module}"]
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def slowest_imports(module, cwd, top):
+    if module == "batch_main":
+        return []
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, check=True, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # 只看顶层 import（嵌套的模块名前面有额外缩进）
+        if name.startswith(" ") and not name.startswith("  "):
+            rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = time_import("sys", ROOT, args.runs)
+    print(f"{'python -c import sys':30s} median {statistics.median(baseline) * 1000:7.1f} ms")
+    for module, cwd in MODULES:
+        timings = time_import(module, cwd, args.runs)
+        print(f"{module:30s} median {statistics.median(timings) * 1000:7.1f} ms   min {min(timings) * 1000:7.1f} ms")
+        for cumulative_us, name in slowest_imports(module, cwd, args.top):
+            print(f"    {cumulative_us / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Compressed embedding storage benchmark (RAG_version/vector_store.py).
+
+Compares the current FAISS IndexFlatL2 (float32) with NumpyIndex over float32 / float16 / int8
+vectors on a synthetic corpus:
+
+- memory footprint of the stored vectors
+- load time (faiss.read_index vs. np.load with mmap)
+- query latency for a batch of queries
+- recall@k against exact search on the float32 IndexFlatL2
+
+Usage:
+    python benchmarks/bench_vectors.py --docs 100000 --dim 384 --queries 100
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "RAG_version"))
+from vector_store import NumpyIndex, normalize, write_vectors
+
+
+def synthetic_corpus(n_docs, dim, n_queries, seed=0):
+    # 带聚类结构的向量，比纯高斯噪声更接近真实的句向量分布
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, n_docs // 100), dim))
+    docs = centers[rng.integers(0, len(centers), n_docs)] + 0.5 * rng.normal(size=(n_docs, dim))
+    queries = docs[rng.integers(0, n_docs, n_queries)] + 0.3 * rng.normal(size=(n_queries, dim))
+    return normalize(docs), normalize(queries)
+
+
+def recall_at_k(ids, truth):
+    k = truth.shape[1]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, truth)]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    docs, queries = synthetic_corpus(args.docs, args.dim, args.queries)
+    workdir = tempfile.mkdtemp()
+    rows = []
+
+    try:
+        import faiss
+    except ImportError:
+        faiss = None
+
+    if faiss is not None:
+        # 基线：当前 vdb.py 的 IndexFlatL2（归一化向量上的 L2 排序与余弦一致）
+        path = os.path.join(workdir, "flat.index")
+        index = faiss.IndexFlatL2(args.dim)
+        index.add(docs)
+        faiss.write_index(index, path)
+        start = time.perf_counter()
+        index = faiss.read_index(path)
+        load_time = time.perf_counter() - start
+        start = time.perf_counter()
+        _, truth = index.search(queries, args.k)
+        query_time = time.perf_counter() - start
+        rows.append(("faiss IndexFlatL2 float32", os.path.getsize(path), load_time, query_time, 1.0))
+    else:
+        truth = None
+
+    for dtype in ["float32", "float16", "int8"]:
+        prefix = os.path.join(workdir, dtype)
+        write_vectors(docs, prefix, dtype=dtype)
+        size = os.path.getsize(f"{prefix}.vectors.npy")
+        if dtype == "int8":
+            size += os.path.getsize(f"{prefix}.scale.npy")
+        start = time.perf_counter()
+        index = NumpyIndex.load(prefix)
+        load_time = time.perf_counter() - start
+        start = time.perf_counter()
+        _, ids = index.search(queries, args.k)
+        query_time = time.perf_counter() - start
+        if truth is None:
+            truth = ids  # 没装 faiss 时以 float32 NumPy 精确检索为基准
+        rows.append((f"numpy {dtype}", size, load_time, query_time, recall_at_k(ids, truth)))
+
+    print(f"{args.docs} docs x {args.dim} dims, {args.queries} queries, recall@{args.k}\n")
+    print(f"{'backend':28s} {'size MB':>9s} {'load ms':>9s} {'query ms':>9s} {'recall':>7s}")
+    for name, size, load_time, query_time, recall in rows:
+        print(f"{name:28s} {size / 2**20:9.1f} {load_time * 1000:9.1f} {query_time * 1000:9.1f} {recall:7.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Offline evaluation of the cascade router (Utils/cascade.py): latency saved vs. quality lost.
+
+For every report and specialist role both the small and the large model are run once. Routing
+decisions are then replayed offline for several confidence thresholds, so one set of calls can be
+used to pick a threshold:
+
+- latency: all-large total vs. cascade total (small call + large call when escalated)
+- quality: for reports that stay on the small model, token F1 of the small output against the
+  large model's output (the large model is treated as the reference)
+
+Usage:
+    python benchmarks/eval_cascade.py "Medical Reports/medical_report_chinese.txt" ...
+    python benchmarks/eval_cascade.py --from-log results/routing_log.jsonl
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+from collections import Counter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dotenv import load_dotenv
+from Utils.cascade import CascadeRouter, parse_self_assessment, with_self_assessment
+from Utils.prompt_layout import PROMPT_TEMPLATES, build_messages, build_system_prompt
+from RAG_version.tools import rule_flags
+
+ROLES = ["Cardiologist", "Psychologist"]
+_TOKEN_RE = re.compile(r"[A-Za-z0-9]+|[　-鿿]")
+
+
+def token_f1(candidate, reference):
+    cand = Counter(t.lower() for t in _TOKEN_RE.findall(candidate or ""))
+    ref = Counter(t.lower() for t in _TOKEN_RE.findall(reference or ""))
+    overlap = sum((cand & ref).values())
+    if not overlap:
+        return 0.0
+    precision = overlap / sum(cand.values())
+    recall = overlap / sum(ref.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def timed(backend, messages):
+    start = time.perf_counter()
+    output = backend.invoke(messages)
+    return output, time.perf_counter() - start
+
+
+def collect(report_paths):
+    rows = []
+    for path in report_paths:
+        with open(path, "r") as file:
+            report = file.read()
+        for role in ROLES:
+            router = CascadeRouter.for_role(role, log_path=None)
+            messages = build_messages(
+                build_system_prompt(role),
+                [(None, PROMPT_TEMPLATES[role].format(medical_report=report))],
+            )
+            small_raw, small_latency = timed(router.small, with_self_assessment(messages))
+            small_output, confidence, findings = parse_self_assessment(small_raw)
+            large_output, large_latency = timed(router.large, messages)
+            rows.append({
+                "report": os.path.basename(path),
+                "role": role,
+                "rule_flags": rule_flags(report, role),
+                "confidence": confidence,
+                "findings": findings,
+                "small_latency": small_latency,
+                "large_latency": large_latency,
+                "f1": token_f1(small_output, large_output),
+            })
+            print(f"{rows[-1]['report']:40s} {role:13s} confidence={confidence} flags={len(rows[-1]['rule_flags'])}")
+    return rows
+
+
+def replay(rows, threshold):
+    router = CascadeRouter(None, None, threshold=threshold, log_path=None)
+    all_large = sum(r["large_latency"] for r in rows)
+    cascade = 0.0
+    kept_f1 = []
+    reasons = Counter()
+    for r in rows:
+        escalate, reason = router.decide(r["rule_flags"], r["confidence"], r["findings"])
+        reasons[reason] += 1
+        if reason == "rule_flags":
+            cascade += r["large_latency"]
+        elif escalate:
+            cascade += r["small_latency"] + r["large_latency"]
+        else:
+            cascade += r["small_latency"]
+            kept_f1.append(r["f1"])
+    return {
+        "threshold": threshold,
+        "escalation_rate": 1 - len(kept_f1) / len(rows),
+        "latency_saved": 1 - cascade / all_large if all_large else 0.0,
+        "kept_small_f1": statistics.mean(kept_f1) if kept_f1 else None,
+        "reasons": dict(reasons),
+    }
+
+
+def summarize_log(path):
+    with open(path, "r") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    large = [r["large_latency"] for r in records if r["large_latency"] is not None]
+    typical_large = statistics.median(large) if large else 0.0
+    # 没升级的请求按大模型的中位延迟估算本来要花的时间
+    saved = sum(typical_large - r["small_latency"] for r in records if not r["escalated"])
+    wasted = sum(r["small_latency"] for r in records if r["escalated"] and r["small_latency"])
+    print(f"{len(records)} routing decisions, escalation rate {sum(r['escalated'] for r in records) / len(records):.0%}")
+    print(f"reasons: {dict(Counter(r['reason'] for r in records))}")
+    print(f"estimated latency saved {saved:.1f}s, spent on escalated small calls {wasted:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("reports", nargs="*")
+    parser.add_argument("--thresholds", default="0.5,0.6,0.7,0.8,0.9")
+    parser.add_argument("--from-log")
+    args = parser.parse_args()
+
+    load_dotenv("hf.env", override=True)
+    if args.from_log:
+        summarize_log(args.from_log)
+        return
+
+    rows = collect(args.reports)
+    print(f"\n{'threshold':>9s} {'escalated':>9s} {'latency saved':>13s} {'kept-small F1':>13s}  reasons")
+    for threshold in (float(t) for t in args.thresholds.split(",")):
+        result = replay(rows, threshold)
+        f1 = "n/a" if result["kept_small_f1"] is None else f"{result['kept_small_f1']:.2f}"
+        print(f"{threshold:9.2f} {result['escalation_rate']:9.0%} {result['latency_saved']:13.0%} {f1:>13s}  {result['reasons']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,99 @@
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 from dotenv import load_dotenv
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from Utils.agent_humanfeedback import Cardiologist, Psychologist, MultidisciplinaryTeam, human_review
+from Utils.agent_humanfeedback import Cardiologist, Psychologist, MultidisciplinaryTeam, human_review, incremental_mdt_update
+from Utils.results_store import ResultsStore
+from Utils.ingestion import read_report
+from Utils.budget import RunBudget
+from Utils.language import Translator, detect_language, output_language
+from Utils.prompt_layout import LANGUAGE_NAMES, working_language
 from dotenv import load_dotenv
 import json, os
-from huggingface_hub import InferenceClient
 
 
 # 加载 hf.env 文件
 load_dotenv("hf_1.env", override=True) # 把文件里的变量写进环境变量 os.environ 里。
 
 # read the medical report
-# with open("Medical Reports/medical_report_english.txt", "r") as file:
-with open("Medical Reports/medical_report_chinese.txt", "r") as file: # 打开文件后，会把文件对象赋值给 file 变量。
-    medical_report = file.read() # 一次性读取整个文件的内容，返回一个 字符串
+# medical_report = read_report("Medical Reports/medical_report_english.txt")
+# read_report 统一编码和空白（与 batch_main 相同），同一份报告在 results store 里的 report_hash 一致
+medical_report = read_report("Medical Reports/medical_report_chinese.txt")
+
+# 语言检测：专科报告、医生修订和 MDT 都用工作语言，修订时不再重复翻译
+report_language = detect_language(medical_report)
+print(f"Report language: {report_language}, working language: {working_language()}")
+
+# 初始报告、每次医生修订和每一版 MDT 都追加记录到 results/results.sqlite
+store = ResultsStore()
+run_id = store.start_run("humanfeedback_main", {"report": "Medical Reports/medical_report_chinese.txt", "language": report_language})
+
+
+# 这份报告的 token / 调用次数 / LLM 时间预算（BUDGET_MAX_TOKENS 等环境变量），初始报告、修订和 MDT 共用
+budget = RunBudget.from_env()
+
+
+def with_budget(agent):
+    agent.budget = budget
+    return agent
+
+
+def recorder(role_name, stage):
+    return lambda output, call: store.record(run_id, medical_report, role_name, output, stage=stage, call=call)
 
 
 
 # -------------------------
 # Step 1: Cardiologist
 # -------------------------
-cardio_initial = Cardiologist(medical_report).run()
-cardio_final = human_review(cardio_initial, "Cardiologist")
+cardio_initial, _ = store.run_agent(run_id, with_budget(Cardiologist(medical_report)), medical_report)
+cardio_final = human_review(cardio_initial, "Cardiologist", record=recorder("Cardiologist", "revision"), budget=budget)
 
 # -------------------------
 # Step 2: Psychologist
 # -------------------------
-psych_initial = Psychologist(medical_report).run()
-psych_final = human_review(psych_initial, "Psychologist")
+psych_initial, _ = store.run_agent(run_id, with_budget(Psychologist(medical_report)), medical_report)
+psych_final = human_review(psych_initial, "Psychologist", record=recorder("Psychologist", "revision"), budget=budget)
 
 # -------------------------
 
 
 # Run the MultidisciplinaryTeam agent to generate the final diagnosis
-final_diagnosis = MultidisciplinaryTeam(cardio_final, psych_final).run()
-final_diagnosis_text = "### Final Diagnosis:\n\n" + final_diagnosis
+final_diagnosis, _ = store.run_agent(run_id, with_budget(MultidisciplinaryTeam(cardio_final, psych_final)), medical_report, stage="mdt")
+
+# -------------------------
+# Step 3: Iterative review rounds
+# 之后的修订只把 diff 交给 MDT 做增量更新，不再完整重跑
+# -------------------------
+reviewed_reports = {"Cardiologist": cardio_final, "Psychologist": psych_final}
+while True:
+    role_name = input("\nRevise a specialist report? Enter Cardiologist / Psychologist (enter 'None' to finish): ").strip()
+    if role_name.lower() in ["none", "无", ""]:
+        break
+    if role_name not in reviewed_reports:
+        print(f"Unknown role: {role_name}")
+        continue
+    revised = human_review(reviewed_reports[role_name], role_name, record=recorder(role_name, "revision"), budget=budget)
+    final_diagnosis = incremental_mdt_update(
+        final_diagnosis, role_name, reviewed_reports[role_name], revised,
+        record=recorder("MultidisciplinaryTeam", "mdt_update"), budget=budget,
+    )
+    reviewed_reports[role_name] = revised
+
+# -------------------------
+# Step 4: 医生要求时才把最终的 MDT 结果翻译一次（译文有缓存）
+# -------------------------
+target_language = output_language(medical_report)
+if final_diagnosis and target_language != working_language():
+    answer = input(f"\nTranslate the final diagnosis to {LANGUAGE_NAMES.get(target_language, target_language)}? (y/n): ")
+    if answer.strip().lower() in ["y", "yes", "是"]:
+        translated, call = Translator().translate(final_diagnosis, target_language, budget)
+        if translated != final_diagnosis:
+            store.record(run_id, medical_report, "Translator", translated, stage="translation", call=call)
+            final_diagnosis = translated
+
+store.finish_run(run_id)
+
+final_diagnosis_text = "### Final Diagnosis:\n\n" + (final_diagnosis or "")
 txt_output_path = "humanfeedback_results/final_diagnosis.txt"
 
 # Ensure the directory exists
@@ -44,6 +103,9 @@ os.makedirs(os.path.dirname(txt_output_path), exist_ok=True)
 with open(txt_output_path, "w") as txt_file:
     txt_file.write(final_diagnosis_text)
 
-print(f"Final diagnosis has been saved to {txt_output_path}")
+print(f"Final diagnosis has been saved to {txt_output_path} (run {run_id} in {store.path})")
+
+budget.write_report("humanfeedback_results/budget_report.json")
+print(budget.summary())
 
 
@@ -1,108 +1,42 @@
 import os
+import sys
+import sqlite3
 from typing import TypedDict
 from dotenv import load_dotenv
 
-from huggingface_hub import InferenceClient
-from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables.graph import StateGraph, START, END
+from langgraph.graph import StateGraph, START, END
+from langgraph.types import interrupt, Command
+from langgraph.checkpoint.sqlite import SqliteSaver
 
+# 让 langgraph_version 里的脚本也能 import 仓库根目录下的 Utils
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Utils.agent_humanfeedback import incremental_mdt_update, reviser_llm
+from Utils.prompt_layout import PROMPT_TEMPLATES, build_messages, build_system_prompt, revision_language_instruction
+from Utils.llm_backends import get_backend
 
-
-# ========== HF Model Wrapper (LangChain-Compatible) ==========
-class HFChatModel:
-    """
-    A simple wrapper to replicate ChatOpenAI-style interface using HuggingFace InferenceClient.
-    """
-    def __init__(self, model_name="openai/gpt-oss-120b", temperature=0):
-        self.client = InferenceClient(model_name) # InferenceClient 默认会去查找环境变量：默认读取 os.environ["HF_TOKEN"]
-        self.temperature = temperature
-
-    def invoke(self, prompt):
-        response = self.client.chat_completion(
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=800,
-            temperature=self.temperature,
-        )
-        # HuggingFace returns: response.choices[0].message
-        return response.choices[0].message["content"]
-    
-# 初始化全局 LLM
-llm = HFChatModel(
-    model_name="openai/gpt-oss-120b",
-    temperature=0
-)
+# 默认的 checkpoint 数据库：每个节点执行完后都会把 MedicalState 写进去
+DEFAULT_CHECKPOINT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "checkpoints.sqlite")
 
 class Agent:
     def __init__(self, medical_report=None, role=None, extra_info=None):
         self.medical_report = medical_report
         self.role = role
         self.extra_info = extra_info
+        self.system_prompt = build_system_prompt(role)
         self.prompt_template = self.create_prompt_template()
 
-        self.model = HFChatModel(
-            model_name="openai/gpt-oss-120b",
-            temperature=0
-        )
+        # 每个角色可以单独配置后端（见 Utils/llm_backends.py），默认仍是 HF 上的 gpt-oss-120b
+        self.model = get_backend(role)
 
     
     def create_prompt_template(self):
-        # --- Integrator Agent (MDT) ---
-        if self.role == "MultidisciplinaryTeam":
-            template = f"""
-                Act like a multidisciplinary team consisting of a Cardiologist and a Psychologist.
-
-                Task:
-                - Integrate both specialist reports.
-                - Provide exactly **3 possible diagnoses**.
-                - For each diagnosis, explain briefly:
-                    1. Why this diagnosis is plausible
-                    2. Whether the cause is cardiac, psychological, or mixed.
-
-                Output:
-                - Bullet list with 3 items.
-                - translate the final output to Chinese.
-
-                Cardiologist Report:
-                {self.extra_info.get('cardiologist_report', '')}
-
-                Psychologist Report:
-                {self.extra_info.get('psychologist_report', '')}
-            """
-            return PromptTemplate.from_template(template)
-
-        # --- Specialist Agents ---
-        templates = {
-            "Cardiologist": """
-                Act like a cardiologist.
-
-                Task:
-                - Analyze the patient's ECG, labs, symptoms, and cardiac history.
-                - Identify possible cardiac causes: arrhythmias, coronary issues, structural problems.
-                - Recommend next steps (tests, monitoring).
+        # 静态的角色说明在 system message 里，每份报告不同的部分用 Utils/prompt_layout.py 里预编译好的模板
+        return PROMPT_TEMPLATES[self.role]
 
-                Output:
-                - Cardiac causes + recommended next steps.
-
-                Medical Report:
-                {medical_report}
-            """,
-
-            "Psychologist": """
-                Act like a psychologist.
-
-                Task:
-                - Analyze emotional and behavioral symptoms.
-                - Identify possible mental health issues: anxiety, depression, trauma, stress-related disorders.
-                - Recommend next steps.
-
-                Output:
-                - Possible psychological issues + next steps.
-
-                Patient Report:
-                {medical_report}
-            """
-        }
-        return PromptTemplate.from_template(templates[self.role])
+    def format_user_content(self):
+        if self.role == "MultidisciplinaryTeam":
+            return self.prompt_template.format(**self.extra_info)
+        return self.prompt_template.format(medical_report=self.medical_report)
 
 
     # -------------------------
@@ -111,13 +45,11 @@ class Agent:
     def run(self):
         print(f"{self.role} is running...")
 
-        if self.role == "MultidisciplinaryTeam":
-            prompt = self.prompt_template.format()
-        else:
-            prompt = self.prompt_template.format(medical_report=self.medical_report)
+        user_content = self.format_user_content()
+        messages = build_messages(self.system_prompt, [(None, user_content)])
 
         try:
-            response = self.model.invoke(prompt)
+            response = self.model.invoke(messages)
             return response
         except Exception as e:
             print("Error occurred:", e)
@@ -158,10 +90,12 @@ def cardiologist_node(state: MedicalState):
     return {"cardio_initial": result}
 
 def cardiologist_review_node(state: MedicalState):
-    print("\n=== Cardiologist Initial Report ===\n")
-    print(state["cardio_initial"])
-
-    feedback = input("\nPlease enter doctor's feedback for the cardiologist report (enter 'None' if no changes): ")
+    # interrupt() 会暂停当前 thread 并把 checkpoint 落盘，不再阻塞在 input() 上；
+    # 恢复时用 Command(resume=feedback) 把医生意见传回来，前面已完成的 LLM 调用不会重跑
+    feedback = interrupt({
+        "role": "Cardiologist",
+        "report": state["cardio_initial"],
+    })
 
     if feedback.strip().lower() in ["none", "无"]:
         final_version = state["cardio_initial"]
@@ -174,8 +108,10 @@ def cardiologist_review_node(state: MedicalState):
 
         Doctor's Feedback:
         {feedback}
+
+        {revision_language_instruction()}
         """
-        final_version = llm.invoke(prompt)
+        final_version = reviser_llm().invoke(prompt)
 
     return {"cardio_final": final_version}
 
@@ -185,9 +121,10 @@ def psychologist_node(state: MedicalState):
     return {"psycho_initial": result}
 
 def psychologist_review_node(state: MedicalState):
-    print("\n=== Psychologist Initial Report ===\n")
-    print(state["psycho_initial"])
-    feedback = input("\nPlease enter doctor's feedback for the psychologist report (enter 'None' if no changes): ")
+    feedback = interrupt({
+        "role": "Psychologist",
+        "report": state["psycho_initial"],
+    })
     if feedback.strip().lower() in ["none", "无"]:
         final_version = state["psycho_initial"]
     else:
@@ -197,8 +134,9 @@ def psychologist_review_node(state: MedicalState):
             {state['psycho_initial']}
             Doctor's Feedback:
             {feedback}
+            {revision_language_instruction()}
             """
-        final_version = llm.invoke(prompt)
+        final_version = reviser_llm().invoke(prompt)
     return {"psycho_final": final_version}
 
 def mdt_node(state: MedicalState):
@@ -209,10 +147,54 @@ def mdt_node(state: MedicalState):
     result = agent.run()
     return {"mdt_report": result}
 
+def revise_report(initial_text, role_name, feedback):
+    prompt = f"""
+        The following is the initial {role_name.lower()} report. Please revise it according to the doctor's feedback:
+
+        Initial Report:
+        {initial_text}
+
+        Doctor's Feedback:
+        {feedback}
+
+        {revision_language_instruction()}
+        """
+    return reviser_llm().invoke(prompt)
+
+def mdt_review_node(state: MedicalState):
+    # 医生看完 MDT 后可以继续修订某一份专科报告：
+    # resume 值为 "None" 时结束；为 {"role": ..., "feedback": ...} 时只做增量 MDT 更新
+    request = interrupt({
+        "role": "MultidisciplinaryTeam",
+        "report": state["mdt_report"],
+    })
+    if isinstance(request, str):
+        return Command(goto=END)
+    if request.get("feedback", "").strip().lower() in ["none", "无", ""]:
+        # 没有修改意见：不调用 LLM，直接回到 MDT 审核
+        return Command(goto="mdt_review")
+
+    role_name = request["role"]
+    final_key = {"Cardiologist": "cardio_final", "Psychologist": "psycho_final"}[role_name]
+    revised = revise_report(state[final_key], role_name, request["feedback"])
+    updated_mdt = incremental_mdt_update(state["mdt_report"], role_name, state[final_key], revised)
+    return Command(
+        update={final_key: revised, "mdt_report": updated_mdt},
+        goto="mdt_review",
+    )
+
 # -------------------------
 # Build Graph Workflow
 # -------------------------
-def build_medical_workflow():
+def build_checkpointer(checkpoint_path=DEFAULT_CHECKPOINT_PATH):
+    """
+    基于 SQLite 的 checkpointer。check_same_thread=False 让同一个连接可以在线程池里复用。
+    """
+    conn = sqlite3.connect(checkpoint_path, check_same_thread=False)
+    return SqliteSaver(conn)
+
+
+def build_medical_workflow(checkpointer=None):
     workflow = StateGraph(MedicalState)
 
     workflow.add_node("cardio", cardiologist_node)
@@ -220,13 +202,71 @@ def build_medical_workflow():
     workflow.add_node("psych", psychologist_node)
     workflow.add_node("psych_review", psychologist_review_node)
     workflow.add_node("mdt", mdt_node)
+    workflow.add_node("mdt_review", mdt_review_node)
 
     workflow.add_edge(START, "cardio")
     workflow.add_edge("cardio", "cardio_review")
     workflow.add_edge("cardio_review", "psych")
     workflow.add_edge("psych", "psych_review")
     workflow.add_edge("psych_review", "mdt")
-    workflow.add_edge("mdt", END)
+    workflow.add_edge("mdt", "mdt_review")
+
+    if checkpointer is None:
+        checkpointer = build_checkpointer()
+    return workflow.compile(checkpointer=checkpointer)
+
+
+# -------------------------
+# Thread helpers (checkpoint / resume)
+# -------------------------
+def thread_config(thread_id):
+    return {"configurable": {"thread_id": thread_id}}
 
-    return workflow.compile()
+
+def pending_interrupts(app, thread_id):
+    """
+    返回某个 thread 当前等待的人工审核（interrupt）列表，每项是 interrupt() 传出的 dict。
+    """
+    snapshot = app.get_state(thread_config(thread_id))
+    return [it.value for it in snapshot.interrupts]
+
+
+def list_pending_reviews(app):
+    """
+    扫描 checkpointer 里的所有 thread，找出正停在人工审核节点上的那些。
+    一个进程可以同时持有很多个暂停中的审核，按需逐个 resume。
+    """
+    # 先把 thread_id 收集完：SqliteSaver.list 迭代期间持有锁，不能在循环里再调用 get_state
+    thread_ids = {checkpoint.config["configurable"]["thread_id"] for checkpoint in app.checkpointer.list(None)}
+    pending = {}
+    for thread_id in sorted(thread_ids):
+        interrupts = pending_interrupts(app, thread_id)
+        if interrupts:
+            pending[thread_id] = interrupts
+    return pending
+
+
+def run_or_resume(app, thread_id, medical_report=None):
+    """
+    如果 thread 已有 checkpoint，就从最后完成的节点继续；否则用 medical_report 新建一次运行。
+    遇到人工审核时返回的 state 里会带 "__interrupt__"。
+    """
+    config = thread_config(thread_id)
+    snapshot = app.get_state(config)
+    if snapshot.next:
+        if snapshot.interrupts:
+            # 还在等医生意见，不重复执行
+            return {**snapshot.values, "__interrupt__": snapshot.interrupts}
+        # 进程在某个节点中途退出：传 None 让 LangGraph 从最后的 checkpoint 继续
+        return app.invoke(None, config)
+    if snapshot.values.get("mdt_report"):
+        return snapshot.values
+    return app.invoke({"medical_report": medical_report}, config)
+
+
+def submit_review(app, thread_id, feedback):
+    """
+    把医生意见作为 interrupt 的返回值，恢复对应 thread。
+    """
+    return app.invoke(Command(resume=feedback), thread_config(thread_id))
 
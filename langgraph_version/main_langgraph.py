@@ -1,25 +1,68 @@
+import argparse
 from dotenv import load_dotenv
-from agent_langgraph import build_medical_workflow
+from agent_langgraph import build_medical_workflow, run_or_resume, submit_review
+from Utils.language import Translator, output_language
+from Utils.prompt_layout import LANGUAGE_NAMES, working_language
 
 # -------------------------
 # Load HuggingFace API key from hf.env
 # -------------------------
 load_dotenv("hf.env", override=True)  # Load environment variables into os.environ
 
-# -------------------------
-# Read medical report file
-# -------------------------
-with open("Medical Reports/panic.txt", "r") as file:
-    medical_report = file.read()
+parser = argparse.ArgumentParser()
+parser.add_argument("--report", default="Medical Reports/panic.txt")
+parser.add_argument("--thread-id", default="default",
+                    help="同一个 thread-id 再次运行时会从最后完成的节点继续")
+args = parser.parse_args()
 
 # -------------------------
 # Build and run workflow
 # -------------------------
 app = build_medical_workflow()
 
-result_state = app.invoke({
-    "medical_report": medical_report
-})
+medical_report = None
+snapshot = app.get_state({"configurable": {"thread_id": args.thread_id}})
+if not snapshot.values:
+    # -------------------------
+    # Read medical report file (only needed for a new thread)
+    # -------------------------
+    with open(args.report, "r") as file:
+        medical_report = file.read()
+
+result_state = run_or_resume(app, args.thread_id, medical_report)
+
+# -------------------------
+# Human review: each interrupt pauses the thread until feedback is submitted
+# -------------------------
+while "__interrupt__" in result_state:
+    review = result_state["__interrupt__"][0].value
+    if review["role"] == "MultidisciplinaryTeam":
+        # MDT 审核：选择要继续修订的专科报告，只做增量更新
+        print("\n=== Current MDT Medical Report ===\n")
+        print(review["report"])
+        role_name = input("\nRevise a specialist report? Enter Cardiologist / Psychologist (enter 'None' to finish): ").strip()
+        if role_name not in ["Cardiologist", "Psychologist"]:
+            result_state = submit_review(app, args.thread_id, "None")
+            continue
+        feedback = input(f"\nPlease enter doctor's feedback for the {role_name.lower()} report (enter 'None' if no changes): ")
+        result_state = submit_review(app, args.thread_id, {"role": role_name, "feedback": feedback})
+        continue
+
+    print(f"\n=== {review['role']} Initial Report ===\n")
+    print(review["report"])
+    feedback = input(f"\nPlease enter doctor's feedback for the {review['role'].lower()} report (enter 'None' if no changes): ")
+    result_state = submit_review(app, args.thread_id, feedback)
+
+final_report = result_state["mdt_report"]
+
+# -------------------------
+# 整个流程都用工作语言；医生要求时才把最终 MDT 结果翻译一次
+# -------------------------
+target_language = output_language(result_state["medical_report"])
+if final_report and target_language != working_language():
+    answer = input(f"\nTranslate the final MDT report to {LANGUAGE_NAMES.get(target_language, target_language)}? (y/n): ")
+    if answer.strip().lower() in ["y", "yes", "是"]:
+        final_report, _ = Translator().translate(final_report, target_language)
 
 print("\n=== Final MDT Medical Report ===\n")
-print(result_state["mdt_report"])
\ No newline at end of file
+print(final_report)
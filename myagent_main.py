@@ -2,32 +2,51 @@
 from dotenv import load_dotenv
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from Utils.myagent import Cardiologist, Psychologist, MultidisciplinaryTeam
+from Utils.results_store import ResultsStore
+from Utils.ingestion import read_report
+from Utils.budget import RunBudget
+from Utils.language import Translator, detect_language, output_language
+from Utils.prompt_layout import working_language
 from dotenv import load_dotenv
 import json, os
-from huggingface_hub import InferenceClient
 
 
 # 加载 hf.env 文件
 load_dotenv("hf_1.env", override=True) # 把文件里的变量写进环境变量 os.environ 里。
 
 # read the medical report
-# with open("Medical Reports/medical_report_english.txt", "r") as file:
-with open("Medical Reports/medical_report_chinese.txt", "r") as file: # 打开文件后，会把文件对象赋值给 file 变量。
-    medical_report = file.read() # 一次性读取整个文件的内容，返回一个 字符串
+# medical_report = read_report("Medical Reports/medical_report_english.txt")
+# read_report 统一编码和空白（与 batch_main 相同），同一份报告在 results store 里的 report_hash 一致
+medical_report = read_report("Medical Reports/medical_report_chinese.txt")
 
+# 语言检测：agent 统一用工作语言推理和输出，报告语言只决定最后把 MDT 结果翻译成什么语言
+report_language = detect_language(medical_report)
+print(f"Report language: {report_language}, working language: {working_language()}")
+
+# 所有输出（含延迟和 token 数）都追加记录到 results/results.sqlite
+# REUSE_RESULTS=1 时，同一份报告、同样模型和 prompt 已经算过的结果直接复用
+store = ResultsStore()
+run_id = store.start_run("myagent_main", {"report": "Medical Reports/medical_report_chinese.txt", "language": report_language})
+reuse = os.environ.get("REUSE_RESULTS") == "1"
+
+# 这份报告的 token / 调用次数 / LLM 时间预算（BUDGET_MAX_TOKENS 等环境变量），用量高时逐级降级
+budget = RunBudget.from_env()
 
 agents = {
     "Cardiologist": Cardiologist(medical_report),
     "Psychologist": Psychologist(medical_report)
 }
+for agent in agents.values():
+    agent.budget = budget
 
 # Function to run each agent and get their response
 def get_response(agent_name, agent):
-    response = agent.run()
-    return agent_name, response
+    response, reused = store.run_agent(run_id, agent, medical_report, reuse=reuse)
+    return agent_name, response, reused
 
 # Run the agents concurrently and collect responses
 responses = {}
+reused = {}
 with ThreadPoolExecutor() as executor: # ThreadPoolExecutor()：Python 的线程池 . 作用：让多个 agent 可以并行运行，节省时间
     futures = {executor.submit(get_response, name, agent): name for name, agent in agents.items()}
     # Python 字典推导式的通用形式：{key_expression: value_expression for variable(s) in iterable if condition}
@@ -37,17 +56,26 @@ with ThreadPoolExecutor() as executor: # ThreadPoolExecutor()：Python 的线程
     # }
     # executor.submit(function, *args)：将函数提交给线程池执行，返回一个 Future 对象, "Cardiologist" 和 "Psychologist" 的 get_response 函数被并发执行
     for future in as_completed(futures):
-        agent_name, response = future.result() # as_completed(futures) 会按完成顺序迭代线程池中的 Future
+        agent_name, response, reused[agent_name] = future.result() # as_completed(futures) 会按完成顺序迭代线程池中的 Future
         responses[agent_name] = response
 
 team_agent = MultidisciplinaryTeam(
     cardiologist_report=responses["Cardiologist"],
     psychologist_report=responses["Psychologist"]
 )
+team_agent.budget = budget
 
 # Run the MultidisciplinaryTeam agent to generate the final diagnosis
-final_diagnosis = team_agent.run()
-final_diagnosis_text = "### Final Diagnosis:\n\n" + final_diagnosis
+# 两份专科报告都是复用的，MDT 的输入也完全相同，可以一起复用
+final_diagnosis, _ = store.run_agent(run_id, team_agent, medical_report, stage="mdt", reuse=reuse and all(reused.values()))
+
+# 只在最后翻译一次最终的 MDT 结果（OUTPUT_LANGUAGE=auto 跟随报告语言，none 不翻译），译文有缓存
+translated, call = Translator().translate(final_diagnosis, output_language(medical_report), budget)
+if translated != final_diagnosis:
+    store.record(run_id, medical_report, "Translator", translated, stage="translation", call=call)
+    final_diagnosis = translated
+store.finish_run(run_id)
+final_diagnosis_text = "### Final Diagnosis:\n\n" + (final_diagnosis or "")
 txt_output_path = "results/final_diagnosis.txt"
 
 # Ensure the directory exists
@@ -57,7 +85,10 @@ os.makedirs(os.path.dirname(txt_output_path), exist_ok=True)
 with open(txt_output_path, "w") as txt_file:
     txt_file.write(final_diagnosis_text)
 
-print(f"Final diagnosis has been saved to {txt_output_path}")
+print(f"Final diagnosis has been saved to {txt_output_path} (run {run_id} in {store.path})")
+
+budget.write_report("results/budget_report.json")
+print(budget.summary())
 
 
 
@@ -0,0 +1,54 @@
+import os
+import re
+
+from Utils.dedup import DedupIndex, same_clinical_content
+
+REPORTS = os.path.join(os.path.dirname(__file__), "..", "Medical Reports")
+ENGLISH_REPORT = open(os.path.join(REPORTS, "medical_report_english.txt"), encoding="utf-8").read()
+CHINESE_REPORT = open(os.path.join(REPORTS, "medical_report_chinese.txt"), encoding="utf-8").read()
+
+
+def change_vital(report, pattern, value):
+    changed, count = re.subn(pattern, lambda m: m.group(1) + value, report, count=1)
+    assert count == 1, pattern
+    return changed
+
+
+def test_only_dates_and_ids_changed_is_reused():
+    resubmitted = re.sub(r"\d{4}-\d{2}-\d{2}", "2026-01-01", CHINESE_REPORT)
+    assert same_clinical_content(CHINESE_REPORT, resubmitted)
+
+
+def test_changed_vital_sign_is_never_reused():
+    index = DedupIndex(":memory:")
+    index.add("english", ENGLISH_REPORT)
+    index.add("chinese", CHINESE_REPORT)
+    cases = [
+        (ENGLISH_REPORT, change_vital(ENGLISH_REPORT, r"(heart rate[^\d]*)\d+", "150")),
+        (CHINESE_REPORT, change_vital(CHINESE_REPORT, r"(脉搏[^\d]*)\d+", "150")),
+        (CHINESE_REPORT, CHINESE_REPORT.replace("无糖尿病", "有糖尿病", 1)),
+    ]
+    for original, changed in cases:
+        assert changed != original
+        # MinHash 认为几乎相同，但临床内容变了，不能直接复用
+        assert index.query(changed) is not None
+        assert not same_clinical_content(original, changed)
+
+
+def test_changed_lab_count_is_not_masked_as_an_id():
+    # 5 位以上的检验值不是编号
+    assert not same_clinical_content(
+        "Patient ID: 345678\nPlatelets: 250000 /uL\nWBC: 12000 /uL",
+        "Patient ID: 345678\nPlatelets: 25000 /uL\nWBC: 12000 /uL",
+    )
+
+
+def test_blood_pressure_triplet_is_not_masked_as_a_date():
+    assert not same_clinical_content("BP 150/95/80 mmHg", "BP 190/95/80 mmHg")
+
+
+def test_labelled_ids_are_masked():
+    assert same_clinical_content(
+        "Patient ID: 345678\n病历号：ZY2025001\nPlatelets: 250000 /uL",
+        "Patient ID: 987654\n病历号：ZY2026117\nPlatelets: 250000 /uL",
+    )